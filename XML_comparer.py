@@ -1,10 +1,13 @@
 import streamlit as st
 import pandas as pd
 import re
+import numpy as np
 from io import BytesIO
+from scipy.sparse import csr_matrix
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.cluster import AgglomerativeClustering
 from sklearn.metrics import pairwise_distances
+from report_name_clustering import SPARSE_MODE_HELP, run_clustering, sparse_agglomerative_labels
 
 ## It takes bsp excels and give groups on basis of names and cols,filters
 
@@ -53,12 +56,19 @@ def process_csv(file):
     return final_df
 
 # Function to create new columns with group IDs for similar report names
-def assign_group_ids(df):
+# mode='exact' clusters the dense distance matrix, mode='sparse' clusters each group of
+# neighbouring names (cosine distance <= 0.5) separately and scales to catalogue-sized inputs.
+# Groups with too many distinct names are approximate in sparse mode and raise an ApproximateClusteringWarning
+def assign_group_ids(df, mode='exact'):
     # Ensure all entries in 'ReportName' are strings and fill missing values
     df['ReportName'] = df['ReportName'].astype(str).fillna('')
 
     vectorizer = TfidfVectorizer()
     X = vectorizer.fit_transform(df['ReportName'])
+    if mode == 'sparse':
+        df['reportGroupId'] = sparse_agglomerative_labels(X, distance_threshold=0.5)
+        return df
+
     distance_matrix = pairwise_distances(X, metric='cosine')
     clustering = AgglomerativeClustering(n_clusters=None, distance_threshold=0.5, affinity='precomputed', linkage='average')
     clustering.fit(distance_matrix)
@@ -66,55 +76,61 @@ def assign_group_ids(df):
 
     return df
 
+# Function to split the ', '-joined column/filter names of a cell into a set
+def split_names(value):
+    return set(str(value).split(', ')) if pd.notna(value) else set()
+
+# Function to find, for every row, the best match percentage against any other row of the group
+# Rows are tokenised once into a sparse binary matrix and all pairwise intersection counts come
+# from one sparse matrix product per block of rows. On ties the later row wins, like the old row-by-row loop
+def best_matches(name_sets, chunk_size=2048):
+    vocabulary = {}
+    indices = []
+    indptr = [0]
+    for names in name_sets:
+        indices.extend(vocabulary.setdefault(name, len(vocabulary)) for name in names)
+        indptr.append(len(indices))
+    n = len(name_sets)
+    matrix = csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr), shape=(n, max(len(vocabulary), 1)))
+    sizes = np.diff(matrix.indptr)
+
+    # Rows sharing nothing with the others match 0% and keep the last other row of the group
+    best_match = np.zeros(n)
+    best_row = np.where(np.arange(n) == n - 1, n - 2, n - 1)
+
+    for start in range(0, n, chunk_size):
+        intersections = (matrix[start:start + chunk_size] @ matrix.T).tocoo()
+        rows = intersections.row + start
+        others = intersections.col
+        keep = rows != others
+        rows, others, counts = rows[keep], others[keep], intersections.data[keep]
+        if not len(rows):
+            continue
+        match = counts / np.maximum(sizes[rows], sizes[others]) * 100
+
+        # Sort by row, then match, then position in the group and keep the last entry of each row
+        order = np.lexsort((others, match, rows))
+        rows, others, match = rows[order], others[order], match[order]
+        last = np.append(rows[1:] != rows[:-1], True)
+        best_match[rows[last]] = match[last]
+        best_row[rows[last]] = others[last]
+
+    return best_match, best_row
+
 # Function to calculate match percentages and differences
 def calculate_matches_and_differences(group):
-    # Initialize the lists to store results
-    column_matches = []
-    filter_matches = []
-    column_differences = []
-    filter_differences = []
-
-    for i, row in group.iterrows():
-        # Convert the columns and filters to strings and split into sets for comparison
-        columns_set = set(str(row['columnnames']).split(', ')) if pd.notna(row['columnnames']) else set()
-        filters_set = set(str(row['Datafilters']).split(', ')) if pd.notna(row['Datafilters']) else set()
-        
-        # Initialize max matches to 0
-        max_column_match = 0
-        max_filter_match = 0
-        
-        # Compare with all other rows in the group
-        for j, compare_row in group.iterrows():
-            if i != j:
-                compare_columns_set = set(str(compare_row['columnnames']).split(', ')) if pd.notna(compare_row['columnnames']) else set()
-                compare_filters_set = set(str(compare_row['Datafilters']).split(', ')) if pd.notna(compare_row['Datafilters']) else set()
-                
-                # Calculate intersection (matches) and differences
-                column_intersection = columns_set.intersection(compare_columns_set)
-                filter_intersection = filters_set.intersection(compare_filters_set)
-                
-                column_difference = columns_set.symmetric_difference(compare_columns_set)
-                filter_difference = filters_set.symmetric_difference(compare_filters_set)
-                
-                # Calculate the match percentages
-                column_match_percentage = len(column_intersection) / max(len(columns_set), len(compare_columns_set)) * 100
-                filter_match_percentage = len(filter_intersection) / max(len(filters_set), len(compare_filters_set)) * 100
-                
-                # Update max matches if current comparison is higher
-                max_column_match = max(max_column_match, column_match_percentage)
-                max_filter_match = max(max_filter_match, filter_match_percentage)
-                
-                # Store differences (we assume we're interested in the first comparison)
-                if max_column_match == column_match_percentage:
-                    column_diff = column_difference
-                if max_filter_match == filter_match_percentage:
-                    filter_diff = filter_difference
-        
-        # Append the results for the current row
-        column_matches.append(max_column_match)
-        filter_matches.append(max_filter_match)
-        column_differences.append(", ".join(column_diff))
-        filter_differences.append(", ".join(filter_diff))
+    # Convert the columns and filters to sets once per row
+    column_sets = [split_names(value) for value in group['columnnames']]
+    filter_sets = [split_names(value) for value in group['Datafilters']]
+
+    column_matches, column_best = best_matches(column_sets)
+    filter_matches, filter_best = best_matches(filter_sets)
+
+    # Differences against the best matching row
+    column_differences = [", ".join(sorted(column_sets[i] ^ column_sets[j])) if j >= 0 else ''
+                          for i, j in enumerate(column_best)]
+    filter_differences = [", ".join(sorted(filter_sets[i] ^ filter_sets[j])) if j >= 0 else ''
+                          for i, j in enumerate(filter_best)]
     
     # Add results as new columns in the group
     group['% of column matches'] = column_matches
@@ -153,12 +169,15 @@ def assign_xmlcompare_groupid(df):
 st.title('Granularity Processor for Report/Search Paths (Excel Output)')
 
 uploaded_file = st.file_uploader("Choose a CSV file", type="csv")
+clustering_mode = st.radio("Report name clustering", ['exact', 'sparse'], horizontal=True, help=SPARSE_MODE_HELP)
 
 if uploaded_file is not None:
     processed_df = process_csv(uploaded_file)
     
     # Assign group IDs based on similar report names
-    processed_df = assign_group_ids(processed_df)
+    processed_df, messages = run_clustering(assign_group_ids, processed_df, mode=clustering_mode)
+    for message in messages:
+        st.warning(message)
 
     # Assign xmlcompare_groupid within reportGroupId
     processed_df = assign_xmlcompare_groupid(processed_df)
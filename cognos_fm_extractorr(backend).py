@@ -1,193 +1,392 @@
 import streamlit as st
 import xml.etree.ElementTree as ET
 import pandas as pd
+import argparse
+import functools
+import hashlib
+import json
+import sys
+from model_dependency_graph import ModelDependencyGraph
 
-def parse_xml(xml_file):
-    namespaces = []
-    tree = ET.parse(xml_file)
-    root = tree.getroot()
-
-    for namespace in root.findall('.//{http://www.developer.cognos.com/schemas/bmt/60/12}namespace'):
-        namespace_info = {}
-        try:
-            namespace_info['name'] = namespace.find('{http://www.developer.cognos.com/schemas/bmt/60/12}name').text
-        except AttributeError:
-            namespace_info['name'] = "N/A"
-        try:
-            namespace_info['lastChanged'] = namespace.find('{http://www.developer.cognos.com/schemas/bmt/60/12}lastChanged').text
-        except AttributeError:
-            namespace_info['lastChanged'] = "N/A"
-        try:
-            namespace_info['lastChangedBy'] = namespace.find('{http://www.developer.cognos.com/schemas/bmt/60/12}lastChangedBy').text
-        except AttributeError:
-            namespace_info['lastChangedBy'] = "N/A"
-
-        # Check if the namespace is a business layer
-        is_business_layer = "Business Layer" in namespace_info['name']
-
-        # Fetch folder details
-        folder_details = []
-        for folder in namespace.findall('.//{http://www.developer.cognos.com/schemas/bmt/60/12}folder'):
-            folder_info = {}
-            try:
-                folder_info['name'] = folder.find('{http://www.developer.cognos.com/schemas/bmt/60/12}name').text
-            except AttributeError:
-                folder_info['name'] = "N/A"
-            try:
-                folder_info['description'] = folder.find('{http://www.developer.cognos.com/schemas/bmt/60/12}description').text or "No description available"
-            except AttributeError:
-                folder_info['description'] = "N/A"
-            try:
-                folder_info['lastChanged'] = folder.find('{http://www.developer.cognos.com/schemas/bmt/60/12}lastChanged').text
-            except AttributeError:
-                folder_info['lastChanged'] = "N/A"
-            try:
-                folder_info['lastChangedBy'] = folder.find('{http://www.developer.cognos.com/schemas/bmt/60/12}lastChangedBy').text
-            except AttributeError:
-                folder_info['lastChangedBy'] = "N/A"
-            folder_details.append(folder_info)
-        namespace_info['folders'] = folder_details
-
-        # Fetch query details
-        query_details = []
-        for query in namespace.findall('.//{http://www.developer.cognos.com/schemas/bmt/60/12}querySubject'):
-            query_info = {}
-            try:
-                query_info['name'] = query.find('{http://www.developer.cognos.com/schemas/bmt/60/12}name').text
-            except AttributeError:
-                query_info['name'] = "N/A"
-            try:
-                query_info['description'] = query.find('{http://www.developer.cognos.com/schemas/bmt/60/12}description').text or "No description available"
-            except AttributeError:
-                query_info['description'] = "N/A"
-            
+# Schema namespace of the models this extractor was written against. Other BMT
+# schema versions are detected from the root element of the model.
+BMT_NS = '{http://www.developer.cognos.com/schemas/bmt/60/12}'
+
+NAMESPACE = 'namespace'
+FOLDER = 'folder'
+QUERY_SUBJECT = 'querySubject'
+QUERY_ITEM = 'queryItem'
+SHORTCUT = 'shortcut'
+
+# Local names of every element the extractor reads
+MODEL_TAGS = (NAMESPACE, FOLDER, QUERY_SUBJECT, QUERY_ITEM, SHORTCUT,
+              'name', 'description', 'lastChanged', 'lastChangedBy', 'externalName',
+              'datatype', 'regularAggregate', 'expression', 'refobj', 'targetType')
+
+# Elements whose subtree is kept until the element itself is finished
+LEAF_RECORDS = (QUERY_SUBJECT, QUERY_ITEM, SHORTCUT)
+# Elements that produce a record
+RECORD_TAGS = (NAMESPACE, FOLDER) + LEAF_RECORDS
+# Children read by their parent after they are finished, so they are never dropped
+KEPT_CHILDREN = ('lastChanged', 'lastChangedBy', 'description')
+
+# Record fields left out of the content hash: they describe where the object sits
+# (already part of its path) or belong to another object with its own hash
+LOCATION_FIELDS = ('type', 'namespace', 'namespacePath', 'querySubject', 'queryItems')
+# Query items repeat the SQL of their query subject, which is hashed with the subject
+INHERITED_FIELDS = {'queryItem': ('sql',)}
+# Columns of the model diff
+DIFF_COLUMNS = ['change', 'type', 'path', 'oldHash', 'newHash']
+
+@functools.lru_cache(maxsize=None)
+def model_tags(schema_ns):
+    """
+    Map of qualified tag -> local name for the MODEL_TAGS of one schema namespace,
+    so every element is identified with a single dictionary lookup.
+    """
+    return {schema_ns + local: local for local in MODEL_TAGS}
+
+def schema_namespace(tag):
+    """
+    '{uri}' prefix of a qualified tag ('' for a tag without namespace).
+    """
+    return tag[:tag.index('}') + 1] if tag.startswith('{') else ''
+
+def direct_children(element, tags):
+    """
+    First direct child of element for each known local name, collected in one pass
+    over the children instead of one find() per field.
+    """
+    children = {}
+    for child in element:
+        local = tags.get(child.tag)
+        if local is not None and local not in children:
+            children[local] = child
+    return children
+
+def child_text(children, tag):
+    child = children.get(tag)
+    return child.text if child is not None else "N/A"
+
+def child_description(children):
+    child = children.get('description')
+    if child is None:
+        return "N/A"
+    return child.text or "No description available"
+
+def query_item_record(query_item, is_business_layer, schema_ns=BMT_NS):
+    children = direct_children(query_item, model_tags(schema_ns))
+    item_info = {
+        'name': child_text(children, 'name'),
+        'description': child_description(children),
+        'externalName': child_text(children, 'externalName'),
+        'dataType': child_text(children, 'datatype'),
+    }
+
+    # Add expression and refobjs for business layer
+    if is_business_layer:
+        expression_element = children.get('expression')
+        if expression_element is not None:
+            item_info['expression'] = ''.join(expression_element.itertext()).strip()
+        else:
+            item_info['expression'] = "N/A"
+        item_info['refobjs'] = [refobj.text for refobj in query_item.iter(schema_ns + 'refobj')]
+    else:
+        item_info['expression'] = "N/A"
+        item_info['refobjs'] = ["N/A"]
+
+    item_info['aggregate'] = child_text(children, 'regularAggregate')
+    return item_info
+
+def iter_model_records(xml_file):
+    """
+    Walk a Framework Manager model.xml in a single pass and yield one record per
+    namespace, folder, query subject, query item and shortcut.
+
+    Every record carries a 'type' key plus the innermost 'namespace' it belongs to
+    and the full 'namespacePath' (a namespace record's path ends with itself).
+    Query subjects are yielded right before their query items. Elements are dropped
+    from the tree as soon as they are finished, so memory stays flat regardless of
+    the model size and each node is visited once. The schema namespace is read from
+    the root element, so models of other BMT versions parse the same way.
+    """
+    stack = []              # currently open elements
+    namespace_names = []    # names of the currently open namespaces
+    open_subjects = []      # query items buffered for each open query subject
+    leaf_depth = 0          # number of open query subjects / query items / shortcuts
+    schema_ns = None        # '{uri}' of the model, taken from the root element
+
+    for event, element in ET.iterparse(xml_file, events=('start', 'end')):
+        if schema_ns is None:
+            schema_ns = schema_namespace(element.tag)
+            tags = model_tags(schema_ns)
+            # Qualified tags checked on every start event
+            namespace_tag = schema_ns + NAMESPACE
+            query_subject_tag = schema_ns + QUERY_SUBJECT
+            leaf_tags = {schema_ns + local for local in LEAF_RECORDS}
+        if event == 'start':
+            stack.append(element)
+            if element.tag == namespace_tag:
+                namespace_names.append("N/A")
+            elif element.tag == query_subject_tag:
+                open_subjects.append([])
+            if element.tag in leaf_tags:
+                leaf_depth += 1
+            continue
+
+        tag = tags.get(element.tag)
+        stack.pop()
+        parent = stack[-1] if stack else None
+        record = None
+
+        if tag not in RECORD_TAGS:
+            if tag == 'name':
+                # Names come first, so everything below can be attributed to its namespace
+                if parent is not None and parent.tag == namespace_tag:
+                    namespace_names[-1] = element.text
+            # Other finished children are dropped unless a leaf record still needs them
+            elif leaf_depth == 0 and parent is not None and tag not in KEPT_CHILDREN:
+                element.clear()
+                parent.remove(element)
+            continue
+
+        if tag == NAMESPACE:
+            children = direct_children(element, tags)
+            record = {
+                'type': 'namespace',
+                'name': namespace_names[-1],
+                'lastChanged': child_text(children, 'lastChanged'),
+                'lastChangedBy': child_text(children, 'lastChangedBy'),
+            }
+
+        elif tag == FOLDER:
+            children = direct_children(element, tags)
+            record = {
+                'type': 'folder',
+                'name': child_text(children, 'name'),
+                'description': child_description(children),
+                'lastChanged': child_text(children, 'lastChanged'),
+                'lastChangedBy': child_text(children, 'lastChangedBy'),
+            }
+
+        elif tag == QUERY_ITEM:
+            if open_subjects:
+                is_business_layer = "Business Layer" in (namespace_names[-1] or '')
+                open_subjects[-1].append(query_item_record(element, is_business_layer, schema_ns))
+
+        elif tag == QUERY_SUBJECT:
+            children = direct_children(element, tags)
             # Fetch SQL query
-            try:
-                query_info['sql'] = query.find('.//{http://www.developer.cognos.com/schemas/bmt/60/12}dbQuery/{http://www.developer.cognos.com/schemas/bmt/60/12}sql').text
-            except AttributeError:
-                query_info['sql'] = "N/A"
-
-            # Fetch query item details
-            query_items = query.findall('.//{http://www.developer.cognos.com/schemas/bmt/60/12}queryItem')
-            query_item_info = []
-            for query_item in query_items:
-                item_info = {}
-                try:
-                    item_info['name'] = query_item.find('{http://www.developer.cognos.com/schemas/bmt/60/12}name').text
-                except AttributeError:
-                    item_info['name'] = "N/A"
-                try:
-                    item_info['description'] = query_item.find('{http://www.developer.cognos.com/schemas/bmt/60/12}description').text or "No description available"
-                except AttributeError:
-                    item_info['description'] = "N/A"
-                try:
-                    item_info['externalName'] = query_item.find('{http://www.developer.cognos.com/schemas/bmt/60/12}externalName').text
-                except AttributeError:
-                    item_info['externalName'] = "N/A"
-                try:
-                    item_info['dataType'] = query_item.find('{http://www.developer.cognos.com/schemas/bmt/60/12}datatype').text
-                except AttributeError:
-                    item_info['dataType'] = "N/A"
-
-                # Add expression and refobjs for business layer
-                if is_business_layer:
-                    try:
-                        expression_element = query_item.find('{http://www.developer.cognos.com/schemas/bmt/60/12}expression')
-                        expression = ET.tostring(expression_element, encoding='unicode', method='text')
-                        item_info['expression'] = expression.strip()
-                    except AttributeError:
-                        item_info['expression'] = "N/A"
-
-                    item_info['refobjs'] = []
-                    try:
-                        refobjs = query_item.findall('.//{http://www.developer.cognos.com/schemas/bmt/60/12}refobj')
-                        for refobj in refobjs:
-                            item_info['refobjs'].append(refobj.text)
-                    except AttributeError:
-                        item_info['refobjs'] = ["N/A"]
-                else:
-                    item_info['expression'] = "N/A"
-                    item_info['refobjs'] = ["N/A"]
-
-                try:
-                    item_info['aggregate'] = query_item.find('{http://www.developer.cognos.com/schemas/bmt/60/12}regularAggregate').text
-                except AttributeError:
-                    item_info['aggregate'] = "N/A"
-
-                query_item_info.append(item_info)
-            query_info['queryItems'] = query_item_info
-
-            query_details.append(query_info)
-        namespace_info['queries'] = query_details
-
-        # Fetch shortcut details
-        shortcut_details = []
-        for shortcut in namespace.findall('.//{http://www.developer.cognos.com/schemas/bmt/60/12}shortcut'):
-            shortcut_info = {}
-            try:
-                shortcut_info['name'] = shortcut.find('{http://www.developer.cognos.com/schemas/bmt/60/12}name').text
-            except AttributeError:
-                shortcut_info['name'] = "N/A"
-            try:
-                shortcut_info['description'] = shortcut.find('{http://www.developer.cognos.com/schemas/bmt/60/12}description').text or "No description available"
-            except AttributeError:
-                shortcut_info['description'] = "N/A"
-            try:
-                shortcut_info['refobj'] = shortcut.find('{http://www.developer.cognos.com/schemas/bmt/60/12}refobj').text
-            except AttributeError:
-                shortcut_info['refobj'] = "N/A"
-            try:
-                shortcut_info['targetType'] = shortcut.find('{http://www.developer.cognos.com/schemas/bmt/60/12}targetType').text
-            except AttributeError:
-                shortcut_info['targetType'] = "N/A"
-
-            shortcut_details.append(shortcut_info)
-        namespace_info['shortcuts'] = shortcut_details
-
-        namespaces.append(namespace_info)
-
-    return namespaces
+            sql = element.find(f'.//{schema_ns}dbQuery/{schema_ns}sql')
+            record = {
+                'type': 'querySubject',
+                'name': child_text(children, 'name'),
+                'description': child_description(children),
+                'sql': sql.text if sql is not None else "N/A",
+                'queryItems': open_subjects.pop(),
+            }
+
+        elif tag == SHORTCUT:
+            children = direct_children(element, tags)
+            record = {
+                'type': 'shortcut',
+                'name': child_text(children, 'name'),
+                'description': child_description(children),
+                'refobj': child_text(children, 'refobj'),
+                'targetType': child_text(children, 'targetType'),
+            }
+
+        if record is not None:
+            record['namespace'] = namespace_names[-1] if namespace_names else "N/A"
+            record['namespacePath'] = '/'.join(name or '' for name in namespace_names)
+            yield record
+            if record['type'] == 'querySubject':
+                for item_info in record['queryItems']:
+                    item_info['type'] = 'queryItem'
+                    item_info['querySubject'] = record['name']
+                    item_info['sql'] = record['sql']
+                    item_info['namespace'] = record['namespace']
+                    item_info['namespacePath'] = record['namespacePath']
+                    yield item_info
+
+        if tag == NAMESPACE:
+            namespace_names.pop()
+        if tag in LEAF_RECORDS:
+            leaf_depth -= 1
+
+        # Drop finished records; leaf records keep their subtree until they end
+        if parent is not None and (tag in LEAF_RECORDS or leaf_depth == 0):
+            element.clear()
+            parent.remove(element)
+
+def parse_xml(xml_file):
+    """
+    Group the streamed model records by namespace. Each folder, query subject and
+    shortcut is listed once, under the namespace that directly contains it.
+    """
+    namespaces = {}
+
+    def namespace_entry(path, name):
+        if path not in namespaces:
+            namespaces[path] = {'name': name, 'lastChanged': "N/A", 'lastChangedBy': "N/A",
+                                'folders': [], 'queries': [], 'shortcuts': []}
+        return namespaces[path]
+
+    for record in iter_model_records(xml_file):
+        record_type = record['type']
+        if record_type == 'namespace':
+            namespace_info = namespace_entry(record['namespacePath'], record['name'])
+            namespace_info['lastChanged'] = record['lastChanged']
+            namespace_info['lastChangedBy'] = record['lastChangedBy']
+            continue
+        if record_type == 'queryItem':
+            continue
+        namespace_info = namespace_entry(record['namespacePath'], record['namespace'])
+        if record_type == 'folder':
+            namespace_info['folders'].append(record)
+        elif record_type == 'querySubject':
+            namespace_info['queries'].append(record)
+        elif record_type == 'shortcut':
+            namespace_info['shortcuts'].append(record)
+
+    return list(namespaces.values())
+
+def record_path(record):
+    """
+    Path of a model object: namespace path, then query subject/shortcut/folder name,
+    then query item name.
+    """
+    if record['type'] == 'namespace':
+        return record['namespacePath']
+    parts = [record['namespacePath']]
+    if record['type'] == 'queryItem':
+        parts.append(record['querySubject'] or '')
+    parts.append(record['name'] or '')
+    return '/'.join(parts)
+
+def record_hash(record):
+    """
+    Content hash of one model object, independent of its children and location.
+    """
+    skipped = LOCATION_FIELDS + INHERITED_FIELDS.get(record['type'], ())
+    content = {key: value for key, value in record.items() if key not in skipped}
+    return hashlib.blake2b(json.dumps(content, sort_keys=True).encode('utf-8'), digest_size=16).hexdigest()
+
+def add_record_hash(hashes, record):
+    """
+    Store the hash of a record under '<type>:<path>'. Objects sharing a path get a #n suffix.
+    """
+    key = f"{record['type']}:{record_path(record)}"
+    if key in hashes:
+        number = 2
+        while f'{key}#{number}' in hashes:
+            number += 1
+        key = f'{key}#{number}'
+    hashes[key] = record_hash(record)
+
+def model_hashes(xml_file):
+    """
+    Content hash of every namespace, folder, query subject, query item and shortcut.
+    """
+    hashes = {}
+    for record in iter_model_records(xml_file):
+        add_record_hash(hashes, record)
+    return hashes
+
+def save_hashes(hashes, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'hashes': hashes}, f, indent=0)
+
+def load_hashes(source):
+    """
+    Hashes of a model, read from a saved hash file (.json) or parsed from a model.xml.
+    source is a path or an uploaded file.
+    """
+    name = source if isinstance(source, str) else getattr(source, 'name', '')
+    if not name.lower().endswith('.json'):
+        return model_hashes(source)
+    if isinstance(source, str):
+        with open(source, encoding='utf-8') as f:
+            return json.load(f)['hashes']
+    return json.load(source)['hashes']
+
+def diff_hashes(old_hashes, new_hashes):
+    """
+    Objects added, removed or changed between two models, sorted by path.
+    """
+    rows = []
+    for key, new_hash in new_hashes.items():
+        old_hash = old_hashes.get(key)
+        if old_hash != new_hash:
+            rows.append(('added' if old_hash is None else 'changed', key, old_hash, new_hash))
+    for key, old_hash in old_hashes.items():
+        if key not in new_hashes:
+            rows.append(('removed', key, old_hash, None))
+
+    diff = pd.DataFrame(rows, columns=['change', 'key', 'oldHash', 'newHash'])
+    diff[['type', 'path']] = diff['key'].str.split(':', n=1, expand=True).reindex(columns=[0, 1])
+    return diff.sort_values(['path', 'type'], kind='stable')[DIFF_COLUMNS].reset_index(drop=True)
+
+def diff_main(argv=None):
+    parser = argparse.ArgumentParser(description="List the objects added, removed or changed between two Framework Manager models.")
+    parser.add_argument('old', help="Previous model.xml, or the hash file saved for it with --save-hashes")
+    parser.add_argument('new', help="Current model.xml")
+    parser.add_argument('-o', '--output', default='model_diff.csv', help="CSV file receiving the changed objects")
+    parser.add_argument('--save-hashes', default=None, help="Save the hashes of the new model here, to diff against it next time without parsing it again")
+    args = parser.parse_args(argv)
+
+    old_hashes = load_hashes(args.old)
+    new_hashes = model_hashes(args.new)
+    if args.save_hashes:
+        save_hashes(new_hashes, args.save_hashes)
+
+    diff = diff_hashes(old_hashes, new_hashes)
+    diff.to_csv(args.output, index=False)
+    counts = diff['change'].value_counts()
+    print(f"{counts.get('added', 0)} added, {counts.get('removed', 0)} removed, {counts.get('changed', 0)} changed "
+          f"out of {len(new_hashes)} objects; written to {args.output}.")
+    return 0
 
 def main():
     st.title("Cognos Backend Accelerator", help="Extract Metadata of Datasources from Framework Manager")
     
     xml_file = st.file_uploader("Upload XML file", type=["xml"])
+    previous_model = st.file_uploader("Upload the previous model.xml or its hash file to see what changed (optional)", type=["xml", "json"])
     if xml_file is not None:
-        namespaces = parse_xml(xml_file)
-
-        if namespaces:
-            for index, namespace in enumerate(namespaces, start=1):
-                print('hi')
-
         # Consolidate all query items into a single dataframe
         consolidated_data = []
-        for namespace in namespaces:
-            namespace_name = namespace['name']
-            for query in namespace['queries']:
-                query_name = query['name']
-                sql_query = query['sql']
-                for item in query['queryItems']:
-                    item['queryName'] = query_name
-                    item['sqlQuery'] = sql_query
-                    item['namespace'] = namespace_name
-                    item['columnName'] = item.pop('name')
-                    item['columnDescription'] = item.pop('description')
-                    item['externalColumnName'] = item.pop('externalName')
-                    item['expression'] = item.pop('expression')
-                    item['refobjs'] = ", ".join(item['refobjs'])  # Combine all refobjs into a single string
-                    item['aggregate'] = item.pop('aggregate')
-                    consolidated_data.append(item)
-            
-            for shortcut in namespace['shortcuts']:
+        # Content hashes are collected in the same pass, for the diff against the previous model
+        hashes = {}
+        # refobj/shortcut dependency graph, also built in the same pass
+        graph = ModelDependencyGraph()
+        for record in iter_model_records(xml_file):
+            add_record_hash(hashes, record)
+            graph.add_record(record)
+            if record['type'] == 'queryItem':
+                item = {
+                    'namespace': record['namespace'],
+                    'queryName': record['querySubject'],
+                    'sqlQuery': record['sql'],
+                    'columnName': record['name'],
+                    'externalColumnName': record['externalName'],
+                    'columnDescription': record['description'],
+                    'dataType': record['dataType'],
+                    'expression': record['expression'],
+                    'refobjs': ", ".join(refobj or '' for refobj in record['refobjs']),  # Combine all refobjs into a single string
+                    'aggregate': record['aggregate']
+                }
+                consolidated_data.append(item)
+
+            elif record['type'] == 'shortcut':
                 item = {
-                    'namespace': namespace_name,
-                    'queryName': shortcut['name'],
+                    'namespace': record['namespace'],
+                    'queryName': record['name'],
                     'sqlQuery': "N/A",
                     'columnName': "N/A",
                     'externalColumnName': "N/A",
-                    'columnDescription': shortcut['description'],
+                    'columnDescription': record['description'],
                     'dataType': "N/A",
-                    'expression': shortcut['refobj'],
+                    'expression': record['refobj'],
                     'aggregate': "N/A"
                 }
                 consolidated_data.append(item)
@@ -210,5 +409,43 @@ def main():
         else:
             st.write("No query data found.")
 
+        if previous_model is not None:
+            diff = diff_hashes(load_hashes(previous_model), hashes)
+            st.info("Changes since the previous model")
+            st.write(diff)
+            st.download_button(
+                label="Download changes as CSV",
+                data=diff.to_csv(index=False).encode('utf-8'),
+                file_name='model_diff.csv',
+                mime='text/csv',
+            )
+
+        st.info("Dependencies")
+        # A database table is used by the business subjects built on its columns and by their shortcuts
+        lookup = st.text_input("Show the lineage of an object, e.g. [Database Layer].[MATERIAL] or [Business Layer].[Product]")
+        if lookup:
+            lineage = [{'object': node, 'relation': relation, **graph.nodes.get(node, {})}
+                       for relation, nodes in (('depends on', graph.dependencies(lookup)), ('used by', graph.dependents(lookup)))
+                       for node in sorted(nodes)]
+            st.write(pd.DataFrame(lineage))
+        st.download_button(
+            label="Download dependency graph",
+            data=graph.to_json().encode('utf-8'),
+            file_name='model_dependency_graph.json',
+            mime='application/json',
+        )
+
+        # Saved hashes let the next diff skip parsing this model again
+        st.download_button(
+            label="Download model hashes",
+            data=json.dumps({'hashes': hashes}, indent=0).encode('utf-8'),
+            file_name='model_hashes.json',
+            mime='application/json',
+        )
+
 if __name__ == "__main__":
-    main()
+    # Any command-line arguments switch to the headless model diff
+    if len(sys.argv) > 1:
+        sys.exit(diff_main(sys.argv[1:]))
+    else:
+        main()
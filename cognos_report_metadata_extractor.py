@@ -1,9 +1,16 @@
 import streamlit as st
 import xml.etree.ElementTree as ET
 import pandas as pd
-import regex as re
+import re
 import openai
 import pandas as pd
+import argparse
+import csv
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from row_accumulator import RowAccumulator
 
 # def convert_to_dax_expression(expression):
 #     response = openai.Completion.create(
@@ -119,109 +126,350 @@ def parse_cognos_report(xml_content):
     
     return report_name, num_pages, package_name, model_name, datasource_details, page_details
 
-st.title("Cognos Report Metadata Extractor", help="This accelerator extracts the metadata from Cognos reports such as datasources used in report, columns used in report pages & much more ")
+# Columns of the final report analysis, in output order
+FINAL_COLUMNS = [
+    'Report Name', 'Report Page Name', 'Query Name', 'Column Name',
+    'Expression', 'Rollup Aggregate', 'Aggregate', 'Used in Report Page', 'Source'
+]
 
-uploaded_files = st.file_uploader("Upload Cognos Report(s) in txt format)", type="txt", accept_multiple_files=True)
+# [namespace].[query subject].[query item] reference in a report expression
+REFERENCE_PATTERN = re.compile(r'\[([^\]]+)\]\.\[([^\]]+)\]\.\[([^\]]+)\]')
+# Same reference with one group spanning "namespace].[query subject", so findall returns plain strings
+SOURCE_PATTERN = re.compile(r'\[([^\]]+\]\.\[[^\]]+)\]\.\[[^\]]+\]')
 
-if uploaded_files:
-    tabs = st.tabs([f"Report {i+1}" for i in range(len(uploaded_files))])
-    
-    final_columns_df = pd.DataFrame()
+def extract_sources(expressions):
+    """
+    Source ("namespace.query subject") of every model reference in each expression of
+    a Series, distinct and comma separated in order of appearance. Missing or
+    reference-free expressions give ''.
+    """
+    # Reports repeat the same expressions a lot, so each distinct one is parsed once
+    codes, unique_expressions = pd.factorize(expressions.fillna('').astype(str))
+    references = pd.Series(unique_expressions, dtype=object).str.findall(SOURCE_PATTERN).explode().dropna()
+    pairs = pd.DataFrame({
+        'expression': references.index,
+        'source': references.str.replace('].[', '.', regex=False).to_numpy(),
+    }).drop_duplicates()
 
-    for tab, uploaded_file in zip(tabs, uploaded_files):
-        with tab:
-            xml_content = uploaded_file.read().decode("utf-8")
-            
-            report_name, num_pages, package_name, model_name, datasource_details, page_details = parse_cognos_report(xml_content)
-            
-            #st.info("Report Details")
-            st.write(f"**Report Name:** {report_name}")
-            st.write(f"**Number of Pages:** {num_pages}")
-            st.write(f"**Package Name:** {package_name}")
-            st.write(f"**Model Name:** {model_name}")
-            
-            #st.info("Datasources used in the Report")
-            for datasource in datasource_details:
-                #st.code(f"Query Name: {datasource['query_name']}")
+    # Most expressions have one source; only the others need a string join
+    shared = pairs['expression'].duplicated(keep=False)
+    single = pairs[~shared].set_index('expression')['source']
+    joined = pairs[shared].groupby('expression', sort=False)['source'].agg(', '.join)
+    sources = pd.concat([single, joined]).reindex(range(len(unique_expressions)), fill_value='')
+    return pd.Series(sources.to_numpy()[codes] if len(codes) else [], index=expressions.index, dtype=object)
+
+def build_report_rows(report_name, datasource_details, page_details):
+    """
+    Flatten the parsed report into one row per query column, flagging the columns used on a report page.
+    Columns shown on several pages list every page name, comma separated.
+    """
+    # Index the pages each (query, column) pair is shown on, built once per report
+    page_index = {}
+    for page in page_details:
+        for content in page['content']:
+            for column_name in content['columns']:
+                page_names = page_index.setdefault((content['ref_query'], column_name), [])
+                if page['page_name'] not in page_names:
+                    page_names.append(page['page_name'])
+
+    rows = []
+    for datasource in datasource_details:
+        query_name = datasource['query_name']
+        for column in datasource['columns']:
+            page_names = page_index.get((query_name, column['name']))
+            used_in_page = "Yes" if page_names else "No"
+            page_name = ", ".join(str(name) for name in page_names) if page_names else "N/A"
+            rows.append({
+                'Report Name': report_name,
+                'Query Name': query_name,
+                'Report Page Name': page_name,
+                'Column Name': column['name'],
+                'Expression': column['expression'],
+                'Rollup Aggregate': column['rollupAggregate'],
+                'Aggregate': column['aggregate'],
+                'Used in Report Page': used_in_page
+            })
+    return rows
+
+# Key of a model item in the FM extractor output (final_backend_data.csv)
+MODEL_KEY = ['namespace', 'table', 'columnName']
+# Columns of the report-to-model lineage, in output order
+LINEAGE_COLUMNS = [
+    'Report Name', 'Query Name', 'Column Name', 'Reference', 'Status',
+    'Hops', 'Model Item', 'Table', 'Physical Column', 'SQL'
+]
+
+def split_references(expressions):
+    """
+    Every [namespace].[query subject].[query item] reference of a Series of
+    expressions, one row per reference, indexed by the expression's index.
+    """
+    references = expressions.fillna('').astype(str).str.extractall(REFERENCE_PATTERN)
+    references.columns = MODEL_KEY
+    return references.reset_index(level='match', drop=True)
+
+class ModelLineageIndex:
+    """
+    Hashed index of the FM extractor output, keyed by (namespace, table, columnName),
+    plus the shortcuts keyed by (namespace, table). Build it once per model and
+    resolve the references of any number of reports against it.
+    """
+
+    def __init__(self, model_df):
+        model_df = model_df.fillna("N/A").astype(str)
+        is_shortcut = model_df['columnName'] == "N/A"
+        self.items = model_df.loc[~is_shortcut, MODEL_KEY + ['externalColumnName', 'sqlQuery', 'expression']].drop_duplicates(MODEL_KEY)
+
+        # Shortcut rows hold their target ("[namespace].[query subject]") in the expression column
+        shortcuts = model_df.loc[is_shortcut, ['namespace', 'table', 'expression']].drop_duplicates(['namespace', 'table'])
+        targets = shortcuts['expression'].str.extract(r'^\s*\[([^\]]+)\]\.\[([^\]]+)\]\s*$')
+        self.shortcuts = pd.DataFrame({
+            'namespace': shortcuts['namespace'], 'table': shortcuts['table'],
+            'targetNamespace': targets[0], 'targetTable': targets[1],
+        }).dropna()
+
+    @classmethod
+    def from_csv(cls, source):
+        return cls(pd.read_csv(source, dtype=str, keep_default_na=False))
+
+    def resolve(self, references, max_hops=5):
+        """
+        Follow each distinct (namespace, table, columnName) reference through shortcuts and
+        business-layer expressions until it reaches an item with SQL (a physical
+        column). All references are moved one hop at a time with a single merge.
+
+        Returns one row per distinct reference and physical column it maps to, with a Status
+        of Resolved, Unresolved (not in the model), No physical source (a
+        calculation without model references) or Hop limit.
+        """
+        keys = references[MODEL_KEY].drop_duplicates().reset_index(drop=True)
+        current = keys.assign(origin=keys.index, Hops=0)
+        found = []
+
+        for hop in range(max_hops + 1):
+            if current.empty:
+                break
+            matched = current.merge(self.items, on=MODEL_KEY, how='left', indicator='inModel')
+            in_model = matched['inModel'] == 'both'
+            physical = in_model & (matched['sqlQuery'] != "N/A")
+            found.append(matched[physical].assign(Status='Resolved'))
+
+            # Business layer items: continue with the references inside their expression
+            logical = matched[in_model & ~physical]
+            next_references = split_references(logical['expression'])
+            next_references = next_references.join(logical[['origin', 'Hops']])
+            without_references = logical[~logical.index.isin(next_references.index)]
+            found.append(without_references.assign(Status='No physical source'))
+
+            # Not an item: the query subject may be a shortcut to another one
+            missing = matched.loc[~in_model, MODEL_KEY + ['origin', 'Hops']]
+            redirected = missing.merge(self.shortcuts, on=['namespace', 'table'], how='left', indicator='isShortcut')
+            found.append(redirected[redirected['isShortcut'] == 'left_only'].assign(Status='Unresolved'))
+            redirected = redirected[redirected['isShortcut'] == 'both']
+            redirected = pd.DataFrame({
+                'namespace': redirected['targetNamespace'], 'table': redirected['targetTable'],
+                'columnName': redirected['columnName'], 'origin': redirected['origin'], 'Hops': redirected['Hops'],
+            })
+
+            current = pd.concat([next_references, redirected], ignore_index=True).drop_duplicates()
+            current['Hops'] += 1
+        found.append(current.assign(Status='Hop limit'))
+
+        lineage = pd.concat(found, ignore_index=True).reindex(columns=MODEL_KEY + ['origin', 'Hops', 'Status', 'externalColumnName', 'sqlQuery'])
+        is_resolved = lineage['Status'] == 'Resolved'
+        lineage['Model Item'] = ('[' + lineage['namespace'] + '].[' + lineage['table'] + '].[' + lineage['columnName'] + ']').where(is_resolved, '')
+        lineage['Table'] = lineage['table'].where(is_resolved, '')
+        lineage['Physical Column'] = lineage['externalColumnName'].where(is_resolved, '')
+        lineage['SQL'] = lineage['sqlQuery'].where(is_resolved, '')
+        lineage = lineage[['origin', 'Status', 'Hops', 'Model Item', 'Table', 'Physical Column', 'SQL']].drop_duplicates()
+
+        return keys.join(lineage.set_index('origin'), how='inner').reset_index(drop=True)
+
+def report_lineage(report_df, model_index, max_hops=5):
+    """
+    Map every model reference in the report expressions to the physical column and SQL it comes from.
+    """
+    references = split_references(report_df['Expression']).rename_axis('row').reset_index()
+    # Each distinct reference is resolved once, however many reports use it
+    lineage = references.merge(model_index.resolve(references, max_hops=max_hops), on=MODEL_KEY, how='left')
+    lineage['Reference'] = '[' + lineage['namespace'] + '].[' + lineage['table'] + '].[' + lineage['columnName'] + ']'
+    lineage = lineage.join(report_df[['Report Name', 'Query Name', 'Column Name']], on='row')
+    return lineage[LINEAGE_COLUMNS]
+
+def parse_report_file(path):
+    """
+    Parse a single report spec file for the batch run.
+    Returns (path, rows, error) so that one broken report never aborts the others.
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            xml_content = f.read()
+        report_name, num_pages, package_name, model_name, datasource_details, page_details = parse_cognos_report(xml_content)
+        rows = build_report_rows(report_name, datasource_details, page_details)
+        sources = extract_sources(pd.Series([row['Expression'] for row in rows], dtype=object))
+        for row, source in zip(rows, sources):
+            row['Source'] = source
+        return path, rows, None
+    except Exception as e:
+        return path, [], f"{type(e).__name__}: {e}"
+
+def collect_report_files(inputs):
+    """
+    Expand directories and glob patterns into the list of report spec files (.txt/.xml).
+    """
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for extension in ('txt', 'xml'):
+                files.extend(glob.glob(os.path.join(item, '**', f'*.{extension}'), recursive=True))
+        else:
+            files.extend(path for path in glob.glob(item, recursive=True) if os.path.isfile(path))
+    return sorted(set(files))
+
+def batch_main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract the metadata of many Cognos report specs without the Streamlit UI.")
+    parser.add_argument('inputs', nargs='+', help="Directories or glob patterns of report spec .txt/.xml files")
+    parser.add_argument('-o', '--output', default='final_report_data.csv', help="CSV file receiving the rows of all reports")
+    parser.add_argument('--error-log', default=None, help="CSV file listing the reports that failed (default: <output>.errors.csv)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument('--chunksize', type=int, default=16, help="Number of reports handed to a worker at a time")
+    parser.add_argument('--flush-rows', type=int, default=100000, help="Rows kept in memory before they are appended to the output")
+    parser.add_argument('--model-csv', default=None, help="FM extractor output (final_backend_data.csv) to trace the report columns against")
+    parser.add_argument('--lineage-output', default=None, help="CSV file receiving the lineage (default: <output>.lineage.csv)")
+    parser.add_argument('--max-hops', type=int, default=5, help="Shortcuts/business-layer references followed before giving up")
+    args = parser.parse_args(argv)
+
+    files = collect_report_files(args.inputs)
+    if not files:
+        print("No report spec files found.")
+        return 1
+    error_log = args.error_log or os.path.splitext(args.output)[0] + '.errors.csv'
+
+    parsed = failed = 0
+    accumulator = RowAccumulator(columns=FINAL_COLUMNS, spill_path=args.output, chunk_size=args.flush_rows)
+    with open(error_log, 'w', newline='', encoding='utf-8') as err:
+        error_writer = csv.writer(err)
+        error_writer.writerow(['File', 'Error'])
+
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            for path, rows, error in executor.map(parse_report_file, files, chunksize=args.chunksize):
+                if error is not None:
+                    failed += 1
+                    error_writer.writerow([path, error])
+                    continue
+                parsed += 1
+                accumulator.extend(rows)
+    accumulator.flush()
+
+    print(f"Parsed {parsed} of {len(files)} reports into {args.output}; {failed} failed (see {error_log}).")
+
+    if args.model_csv and parsed:
+        lineage_output = args.lineage_output or os.path.splitext(args.output)[0] + '.lineage.csv'
+        # The model is indexed once; the report rows are streamed back in chunks
+        model_index = ModelLineageIndex.from_csv(args.model_csv)
+        unresolved = set()
+        for number, chunk in enumerate(pd.read_csv(args.output, chunksize=args.flush_rows)):
+            lineage_df = report_lineage(chunk, model_index, max_hops=args.max_hops)
+            unresolved.update(lineage_df.loc[lineage_df['Status'] != 'Resolved', 'Reference'])
+            lineage_df.to_csv(lineage_output, mode='w' if number == 0 else 'a', header=number == 0, index=False)
+        print(f"Lineage written to {lineage_output}; {len(unresolved)} distinct references could not be traced to a physical column.")
+    return 0
+
+def main():
+    st.title("Cognos Report Metadata Extractor", help="This accelerator extracts the metadata from Cognos reports such as datasources used in report, columns used in report pages & much more ")
+
+    uploaded_files = st.file_uploader("Upload Cognos Report(s) in txt format)", type="txt", accept_multiple_files=True)
+    # Output of the FM extractor, to trace report columns back to the physical model
+    model_file = st.file_uploader("Upload the FM extractor output (final_backend_data.csv) for lineage (optional)", type="csv")
+
+    if uploaded_files:
+        tabs = st.tabs([f"Report {i+1}" for i in range(len(uploaded_files))])
+        
+        # Source is derived once all rows are collected
+        accumulator = RowAccumulator(columns=FINAL_COLUMNS[:-1])
+
+        for tab, uploaded_file in zip(tabs, uploaded_files):
+            with tab:
+                xml_content = uploaded_file.read().decode("utf-8")
                 
-                if datasource['columns']:
-                    columns_df = pd.DataFrame(datasource['columns'])
-                    #st.dataframe(columns_df)
+                report_name, num_pages, package_name, model_name, datasource_details, page_details = parse_cognos_report(xml_content)
                 
-                if datasource['detail_filters']:
-                    #st.write("**Detail Filters:**")
-                    filters_df = pd.DataFrame(datasource['detail_filters'])
-                    #st.dataframe(filters_df)
-            
-            # st.info("Pages present inside Report")
-            for page in page_details:
-                #st.subheader(f"Report Page: {page['page_name']}")
+                #st.info("Report Details")
+                st.write(f"**Report Name:** {report_name}")
+                st.write(f"**Number of Pages:** {num_pages}")
+                st.write(f"**Package Name:** {package_name}")
+                st.write(f"**Model Name:** {model_name}")
                 
-                for content in page['content']:
-                    # st.write(f"**Referenced Query:** {content['ref_query']}")
-                    if content['columns']:
-                        columns_df = pd.DataFrame(content['columns'], columns=['Column Name'])
+                #st.info("Datasources used in the Report")
+                for datasource in datasource_details:
+                    #st.code(f"Query Name: {datasource['query_name']}")
+                    
+                    if datasource['columns']:
+                        columns_df = pd.DataFrame(datasource['columns'])
                         #st.dataframe(columns_df)
-    
-            # Collecting data for the final dataframe
-            rows = []
-            for datasource in datasource_details:
-                query_name = datasource['query_name']
-                for column in datasource['columns']:
-                    used_in_page = "No"
-                    page_name = "N/A"
-                    for page in page_details:
-                        for content in page['content']:
-                            if content['ref_query'] == query_name and column['name'] in content['columns']:
-                                used_in_page = "Yes"
-                                page_name = page['page_name']
-                                break
-                    rows.append({
-                        'Report Name': report_name,
-                        'Query Name': query_name,
-                        'Report Page Name': page_name,
-                        'Column Name': column['name'],
-                        'Expression': column['expression'],
-                        'Rollup Aggregate': column['rollupAggregate'],
-                        'Aggregate': column['aggregate'],
-                        'Used in Report Page': used_in_page
-                    })
-            final_columns_df = pd.concat([final_columns_df, pd.DataFrame(rows)], ignore_index=True)
-        # Define regex pattern
-    pattern = r'\[([^\]]+)\]\.\[([^\]]+)\]\.\[([^\]]+)\]'
-
-    # Function to extract source
-    def extract_source(text):
-        match = re.search(pattern, text)
-        if match:
-            return f"{match.group(1)}.{match.group(2)}"
-        else:
-            return ''
+                    
+                    if datasource['detail_filters']:
+                        #st.write("**Detail Filters:**")
+                        filters_df = pd.DataFrame(datasource['detail_filters'])
+                        #st.dataframe(filters_df)
+                
+                # st.info("Pages present inside Report")
+                for page in page_details:
+                    #st.subheader(f"Report Page: {page['page_name']}")
+                    
+                    for content in page['content']:
+                        # st.write(f"**Referenced Query:** {content['ref_query']}")
+                        if content['columns']:
+                            columns_df = pd.DataFrame(content['columns'], columns=['Column Name'])
+                            #st.dataframe(columns_df)
+        
+                # Collecting data for the final dataframe
+                accumulator.extend(build_report_rows(report_name, datasource_details, page_details))
 
-    # Apply function to create new column
-    final_columns_df['Source'] = final_columns_df['Expression'].apply(extract_source)
+        final_columns_df = accumulator.to_frame()
 
-    # Rearranging columns so that 'Report Name' is first
-    final_columns_df = final_columns_df[[
-        'Report Name', 'Report Page Name', 'Query Name', 'Column Name', 
-        'Expression', 'Rollup Aggregate', 'Aggregate', 'Used in Report Page','Source'
-    ]]
+        # Source of every model reference, extracted for all rows at once
+        final_columns_df['Source'] = extract_sources(final_columns_df['Expression'])
 
-    # Process the dataframe
-    #final_columns_df = process_dataframe(final_columns_df)
+        # Rearranging columns so that 'Report Name' is first
+        final_columns_df = final_columns_df[FINAL_COLUMNS]
 
-    st.info("Report Analysis")
-    st.dataframe(final_columns_df)
-    
+        # Process the dataframe
+        #final_columns_df = process_dataframe(final_columns_df)
+
+        st.info("Report Analysis")
+        st.dataframe(final_columns_df)
+        
+
+
+        # Add download button for the final dataframe
+        csv_data = final_columns_df.to_csv(index=False).encode('utf-8')
+        st.download_button(
+            label="Download data as CSV",
+            data=csv_data,
+            file_name='final_report_data.csv',
+            mime='text/csv',
+        )
 
+        if model_file is not None:
+            lineage_df = report_lineage(final_columns_df, ModelLineageIndex.from_csv(model_file))
+            unresolved = lineage_df[lineage_df['Status'] != 'Resolved']
+            st.info("Report to Model Lineage")
+            st.dataframe(lineage_df)
+            if not unresolved.empty:
+                st.warning(f"{unresolved['Reference'].nunique()} references could not be traced to a physical column")
+            st.download_button(
+                label="Download lineage as CSV",
+                data=lineage_df.to_csv(index=False).encode('utf-8'),
+                file_name='report_lineage.csv',
+                mime='text/csv',
+            )
+    else:
+        print("Please upload one or more Cognos reports in txt format.")
 
-    # Add download button for the final dataframe
-    csv = final_columns_df.to_csv(index=False).encode('utf-8')
-    st.download_button(
-        label="Download data as CSV",
-        data=csv,
-        file_name='final_report_data.csv',
-        mime='text/csv',
-    )
-else:
-    print("Please upload one or more Cognos reports in txt format.")
+if __name__ == "__main__":
+    # Any command-line arguments switch to the headless batch mode
+    if len(sys.argv) > 1:
+        sys.exit(batch_main(sys.argv[1:]))
+    else:
+        main()
@@ -2,6 +2,7 @@ import streamlit as st
 import xml.etree.ElementTree as ET
 import pandas as pd
 from io import StringIO
+from row_accumulator import RowAccumulator
 
 def parse_xml(xml_content):
     root = ET.fromstring(xml_content)
@@ -90,7 +91,7 @@ st.title("Cognos XML to CSV Extractor")
 uploaded_files = st.file_uploader("Upload Cognos XML Files", type="xml", accept_multiple_files=True)
 
 if uploaded_files:
-    combined_df = pd.DataFrame()
+    accumulator = RowAccumulator()
     summary_list = []
 
     for uploaded_file in uploaded_files:
@@ -99,12 +100,15 @@ if uploaded_files:
         # Parse XML and get DataFrame and summary data
         df, report_summary = parse_xml(xml_content)
         
-        # Combine all DataFrames
-        combined_df = pd.concat([combined_df, df], ignore_index=True)
+        # Collect the rows of all DataFrames
+        accumulator.extend_frame(df)
         
         # Collect summary data
         summary_list.append(report_summary)
     
+    # Combine all DataFrames once
+    combined_df = accumulator.to_frame()
+
     # Convert summary list to DataFrame
     summary_df = pd.DataFrame(summary_list)
     
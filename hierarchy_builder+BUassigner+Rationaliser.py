@@ -3,127 +3,250 @@
 
 import streamlit as st
 import pandas as pd
+import numpy as np
+import json
+import os
 import re
 from sklearn.cluster import AgglomerativeClustering
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics import pairwise_distances
-
-def extract_levels(search_path):
-    pattern_double_quotes = re.compile(r'"([^"]*)"')
-    pattern_single_quotes = re.compile(r"'([^']*)'")
-
-    matches_double = pattern_double_quotes.findall(search_path)
-    matches_single = pattern_single_quotes.findall(search_path)
-
-    matches = []
-    last_pos = 0
-    for match in re.finditer(r'"([^"]*)"|\'([^\']*)\'', search_path):
-        if match.group(1):
-            matches.append(match.group(1))
-        elif match.group(2):
-            matches.append(match.group(2))
-
-    data = {f'level{i+1}': match for i, match in enumerate(matches[:-1])}
-    if matches:
-        data['reportName'] = matches[-1]
-    data['originalPath'] = search_path
-    return data
-
-def replace_folder_keywords(path):
-    folder_keywords = ['folder', 'folder@name', 'latest']
-    for keyword in folder_keywords:
-        path = path.replace(keyword, '')
-    return path
+from sklearn.metrics import adjusted_rand_score, pairwise_distances
+from report_name_clustering import SPARSE_MODE_HELP, run_clustering, sparse_agglomerative_labels
+
+# Quoted names in a search path, e.g. /content/folder[@name='Sales']/report[@name="Daily"]
+LEVEL_PATTERN = re.compile(r'"[^"]*"|\'[^\']*\'')
+FIRST_WORD_PATTERN = re.compile(r'(\S+)')
+# mode='exact' clusters the dense distance matrix, 'sparse' gives the same groups one
+# neighbourhood at a time, 'blocked' only compares names within a folder or name prefix.
+# In both, a neighbourhood with more than 5000 distinct names is only approximated and
+# raises an ApproximateClusteringWarning
+CLUSTER_MODES = ['exact', 'sparse', 'blocked']
+BLOCK_KEYS = ['folder', 'prefix']
+# Keyword tables for the Region, decommission flag and Business Unit columns
+KEYWORDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hierarchy_keywords.json')
+
+def extract_levels(search_paths):
+    """
+    Quoted names of each search path as level1, level2, ... columns, with the last one
+    as reportName, plus the path itself as originalPath. Empty names are skipped.
+    All paths are matched in one findall pass and exploded to one row per name.
+    """
+    names = search_paths.reset_index(drop=True).str.findall(LEVEL_PATTERN).explode()
+    # Strip the quotes; '""' and "''" leave nothing
+    names = names.dropna().str[1:-1]
+    names = names[names.ne('')].rename('name').rename_axis('row').reset_index()
+
+    # Number the names of each path; the last one is the report name
+    names['position'] = names.groupby('row').cumcount()
+    is_last = ~names['row'].duplicated(keep='last')
+    report_names = names[is_last].set_index('row')['name']
+    levels = names[~is_last].pivot(index='row', columns='position', values='name')
+    levels.columns = [f'level{position + 1}' for position in levels.columns]
+
+    levels = levels.reindex(range(len(search_paths)))
+    levels['reportName'] = report_names
+    levels['originalPath'] = search_paths.to_numpy()
+    return levels.rename_axis(None)
 
 def process_file(uploaded_file):
     df = pd.read_csv(uploaded_file)
     # Replace empty, null, or blank 'Search Path' with 'no name'
-    df['Search Path'] = df['Search Path'].fillna('').apply(lambda x: 'no name' if x.strip() == '' else x)
-    
-    extracted_data = [extract_levels(path) for path in df['Search Path']]
-    extracted_df = pd.DataFrame(extracted_data)
+    search_paths = df['Search Path'].fillna('')
+    df['Search Path'] = search_paths.where(search_paths.str.strip().ne(''), 'no name')
+
+    extracted_df = extract_levels(df['Search Path'])
     # Keep the input columns
     extracted_df = pd.concat([df.reset_index(drop=True), extracted_df], axis=1)
     cols = [col for col in extracted_df.columns if col not in ['reportName', 'originalPath']] + ['reportName', 'originalPath']
     extracted_df = extracted_df[cols]
     return extracted_df
 
-def cluster_report_names(df):
+def report_name_blocks(df, block_by='folder', prefix_length=4):
+    """
+    Block key of each row for the blocked clustering mode: the level1/level2 folders,
+    or the first prefix_length letters and digits of the lower-cased report name.
+    """
+    if block_by == 'prefix':
+        return df['reportName'].str.lower().str.replace(r'[\W_]+', '', regex=True).str[:prefix_length].to_numpy()
+    folders = [df[col].fillna('') if col in df.columns else pd.Series('', index=df.index) for col in ['level1', 'level2']]
+    return (folders[0] + '/' + folders[1]).to_numpy()
+
+def cluster_report_names(df, mode='exact', block_by='folder'):
     # Ensure all entries in 'reportName' are strings and fill missing values
     df['reportName'] = df['reportName'].astype(str).fillna('')
 
     vectorizer = TfidfVectorizer()
     X = vectorizer.fit_transform(df['reportName'])
+    if mode == 'sparse':
+        df['reportGroupId'] = sparse_agglomerative_labels(X, distance_threshold=0.5)
+        return df
+    if mode == 'blocked':
+        # Memory is bounded by the largest block instead of the whole inventory
+        df['reportGroupId'] = sparse_agglomerative_labels(X, distance_threshold=0.5, blocks=report_name_blocks(df, block_by))
+        return df
+
     distance_matrix = pairwise_distances(X, metric='cosine')
     clustering = AgglomerativeClustering(n_clusters=None, distance_threshold=0.5, affinity='precomputed', linkage='average')
     clustering.fit(distance_matrix)
     df['reportGroupId'] = clustering.labels_
     return df
 
-def concat_first_words(row):
-    first_words = [row[col].split()[0] for col in row.index if col.startswith('level') and not pd.isna(row[col])]
-    return '-'.join(first_words)
-
-def assign_region(concatenated_first_words):
-    keywords_to_level2 = {
-        'NAT': 'NA',
-        'NA': 'NA',
-        'EMEA':'EMEA',
-        'EU': 'EMEA',
-        'Global': 'Global',
-        'LA': 'LA',
-        'AP': 'AP',
-        'APAC': 'AP'
-    }
-    parts = concatenated_first_words.split('-')
-    for part in parts:
-        for keyword, region in keywords_to_level2.items():
-            if part.lower().endswith(keyword.lower()):
-                return region
-    return 'Others'
-
-def check_flags(path):
-    flag_keywords = [
-        'CAM', 'upgrade', 'template', 'temp', 'temporary', 'old data', 'test',
-        'remove', 'audit', 'sample', 'Ibm', 'development', 'backup', 'ad hoc', 'adhoc',
-        'tableau', 'archive', 'my folder', 'not used', 'old', 'delete', 'archiv', 'obsolete',
-        'Jira', 'teradata', 'cleanup', 'bkp', 'copy', 'testing', '(1)','Workbook Report'
-    ]
-    path = replace_folder_keywords(path)
-    path_lower = path.lower()
-    for keyword in flag_keywords:
-        if keyword.lower() in path_lower:
-            return 'yes', keyword
-    return 'no', ''
-
-def assign_business_unit(search_path):
-    if isinstance(search_path, str):
-        business_units = {
-            'Inventory': ['inventory', 'stock', 'warehouse', 'storage', 'supply chain', 'material', 'SKU', 'capacity', 'demand planning'],
-            'Customer': ['customer', 'client', 'user', 'consumer', 'service'],
-            'Sales': ['sales', 'revenue', 'orders', 'transactions', 'deals', 'sell out', 'targets', 'dollars'],
-            'Marketing': ['marketing', 'advertisement', 'campaign', 'promotion', 'branding'],
-            'Manufacturing': ['manufacturing', 'production', 'assembly', 'factory', 'plant'],
-            'Human Resources (HR)': ['HR', 'human resources', 'employee', 'staff', 'recruitment', 'payroll'],
-            'Finance': ['finance', 'accounting', 'budget', 'expenditure', 'cost', 'profit', 'loss', 'billing', 'cash', 'invoice'],
-            'Research and Development (R&D)': ['R&D', 'research', 'development', 'innovation', 'laboratory', 'testing'],
-            'Quality Assurance (QA)': ['QA', 'quality assurance', 'inspection', 'compliance', 'standards'],
-            'IT and Support': ['IT', 'information technology', 'support', 'helpdesk', 'infrastructure'],
-            'Logistics': ['logistics', 'transportation', 'shipping', 'delivery', 'fleet', 'shipment', 'transport', 'freight', 'cargo', 'fulfillment', 'fulfilment'],
-            'Procurement': ['procurement', 'purchasing', 'supplier', 'vendor', 'sourcing'],
-            'Legal': ['legal', 'compliance', 'regulation', 'contracts', 'law', 'claims'],
-            'Miscellaneous': ['Amazon', 'travel', 'locations']
-        }
-        
-        for bu, keywords in business_units.items():
-            if any(keyword in search_path.lower() for keyword in keywords):
-                return bu
-    return 'Other'
+def compare_with_exact(df, mode, block_by='folder', sample_size=2000, random_state=0):
+    """
+    Adjusted Rand score between exact mode and the given mode on a random sample of
+    rows (1.0 means the same groups).
+    """
+    sample = df.sample(n=min(sample_size, len(df)), random_state=random_state).reset_index(drop=True)
+    exact = cluster_report_names(sample.copy(), mode='exact')['reportGroupId']
+    other = cluster_report_names(sample.copy(), mode=mode, block_by=block_by)['reportGroupId']
+    return adjusted_rand_score(exact, other)
+
+def concat_first_words(df):
+    """
+    First word of every level of each row, joined with '-', for the Region Assigner column.
+    """
+    concatenated = pd.Series('', index=df.index)
+    for col in [col for col in df.columns if col.startswith('level')]:
+        # Same word as str.split()[0]; blank levels have none and are skipped
+        first_words = df[col].str.extract(FIRST_WORD_PATTERN, expand=False)
+        separator = np.where(concatenated.eq(''), '', '-')
+        concatenated = concatenated.where(first_words.isna(), concatenated + separator + first_words)
+    return concatenated
+
+def load_keywords(source=KEYWORDS_FILE):
+    """
+    Read the keyword tables (business units, decommission flags, folder keywords and
+    regions) from a JSON file, a path or an uploaded file. Tables are checked in file
+    order, so the first entry that matches wins, as before.
+    """
+    if isinstance(source, str):
+        with open(source, encoding='utf-8') as f:
+            return json.load(f)
+    return json.load(source)
+
+def keyword_automaton(ranked_keywords):
+    """
+    Aho-Corasick automaton over the keywords, or None when pyahocorasick is not installed.
+    """
+    try:
+        import ahocorasick
+    except ImportError:
+        return None
+    automaton = ahocorasick.Automaton()
+    for keyword, rank in ranked_keywords:
+        automaton.add_word(keyword, rank)
+    automaton.make_automaton()
+    return automaton
+
+class KeywordMatcher:
+    """
+    One keyword table, compiled once and run over a whole column.
+
+    Keywords rank by their position in the table and each text gets the label of the
+    best ranked keyword it contains, the same answer as testing the keywords in order.
+    With pyahocorasick installed (pip install pyahocorasick) an Aho-Corasick automaton
+    finds every keyword in one scan of the text; otherwise the keywords are tested in
+    rank order with plain substring search, which beats a combined regex in CPython.
+    """
+
+    def __init__(self, keywords, labels=None):
+        self.keywords = list(keywords)
+        self.labels = np.array(self.keywords if labels is None else list(labels), dtype=object)
+        first = {}
+        for rank, keyword in enumerate(self.keywords):
+            first.setdefault(keyword, rank)
+        # A repeated keyword can only ever match at its first rank
+        self.ranked = tuple(first.items())
+        self.automaton = keyword_automaton(self.ranked)
+        # Endings of '-' separated parts: the leftmost match is the longest ending of the
+        # first part that has one, and every other ending of that part is a suffix of it
+        part_keywords = sorted((keyword for keyword in first if '-' not in keyword), key=len, reverse=True)
+        self.part_end_pattern = re.compile('(' + '|'.join(map(re.escape, part_keywords)) + r')(?=-|\Z)')
+        self.suffix_rank = {keyword: min(rank for other, rank in first.items() if keyword.endswith(other)) for keyword in part_keywords}
+
+    def first_rank(self, text):
+        if self.automaton is not None:
+            return min((rank for _, rank in self.automaton.iter(text)), default=np.nan)
+        for keyword, rank in self.ranked:
+            if keyword in text:
+                return rank
+        return np.nan
+
+    def rank(self, texts):
+        """
+        Rank of the best keyword found anywhere in each text (NaN if none). Each distinct
+        text is only scanned once.
+        """
+        codes, uniques = pd.factorize(texts)
+        ranks = np.array([self.first_rank(text) for text in uniques], dtype=float)
+        return pd.Series(ranks[codes] if len(ranks) else np.full(len(texts), np.nan), index=texts.index)
+
+    def part_end_rank(self, texts):
+        """
+        Rank of the best keyword ending the first '-' separated part that ends with one
+        (NaN if none).
+        """
+        return texts.str.extract(self.part_end_pattern, expand=False).map(self.suffix_rank)
+
+    def label(self, ranks, default):
+        """
+        Label of each rank from rank() or part_end_rank(), default where there is none.
+        """
+        found = ranks.notna().to_numpy()
+        result = np.full(len(ranks), default, dtype=object)
+        result[found] = self.labels[ranks[found].to_numpy(dtype=int)]
+        return pd.Series(result, index=ranks.index)
+
+def assign_regions(region_assigners, matcher):
+    """
+    Region of the first '-' separated part that ends with a region keyword, 'Others' if none.
+    """
+    return matcher.label(matcher.part_end_rank(region_assigners.fillna('').str.lower()), 'Others')
+
+def check_flags(paths, matcher, folder_keywords):
+    """
+    ('yes', keyword) for paths containing a decommission keyword, ('no', '') otherwise.
+    Folder keywords are removed first, one after the other, so they do not raise flags.
+    """
+    for keyword in folder_keywords:
+        paths = paths.str.replace(keyword, '', regex=False)
+    reasons = matcher.label(matcher.rank(paths.str.lower()), '')
+    return reasons.ne('').map({True: 'yes', False: 'no'}), reasons
+
+def assign_business_units(search_paths, matcher):
+    """
+    First business unit with a keyword in the search path, 'Other' if none or not a string.
+    """
+    is_text = search_paths.map(lambda path: isinstance(path, str))
+    units = matcher.label(matcher.rank(search_paths.where(is_text, '').str.lower()), 'Other')
+    return units.where(is_text, 'Other')
+
+def classify_paths(df, keywords):
+    """
+    Add the Region, decommission flag and Business Unit columns, building each keyword
+    matcher once for the whole file.
+    """
+    regions = keywords['regions']
+    region_matcher = KeywordMatcher([keyword.lower() for keyword in regions], list(regions.values()))
+    flag_matcher = KeywordMatcher([keyword.lower() for keyword in keywords['flagKeywords']], keywords['flagKeywords'])
+    # Business unit keywords are compared as written with the lower-cased path, so the
+    # upper-case ones (HR, IT, QA, ...) only match if they are listed in lower case
+    unit_keywords = [(keyword, unit) for unit, unit_keywords in keywords['businessUnits'].items() for keyword in unit_keywords]
+    unit_matcher = KeywordMatcher([keyword for keyword, unit in unit_keywords], [unit for keyword, unit in unit_keywords])
+
+    df['Region'] = assign_regions(df['Region Assigner'], region_matcher)
+    df['Flag for Decommission'], df['reasonForFlagOfDecommission'] = check_flags(df['originalPath'], flag_matcher, keywords['folderKeywords'])
+    df['Business Unit'] = assign_business_units(df['Search Path'], unit_matcher)
+    return df
 
 def main():
     st.title("Cognos BI Environment Extractor & Report Rationalization")
     st.write("Upload a CSV file with search paths to extract levels & rationalize them dynamically.")
     uploaded_file = st.file_uploader("Choose a CSV file", type="csv")
+    keywords_file = st.file_uploader("Keyword tables (optional, JSON)", type="json")
+    clustering_mode = st.radio("Report name clustering", CLUSTER_MODES, horizontal=True,
+                               help=SPARSE_MODE_HELP + "; 'blocked' only groups names within the same folder or name prefix and scales to the whole Content Store")
+    block_by = st.radio("Block report names by", BLOCK_KEYS, horizontal=True) if clustering_mode == 'blocked' else 'folder'
+    compare_sample = st.checkbox("Compare with exact mode on a sample") if clustering_mode != 'exact' else False
 
     if uploaded_file is not None:
         try:
@@ -133,7 +256,13 @@ def main():
             return
 
         try:
-            extracted_df = cluster_report_names(extracted_df)
+            if compare_sample:
+                score = compare_with_exact(extracted_df, clustering_mode, block_by)
+                st.write(f"Adjusted Rand score against exact mode on a sample: {score:.3f}")
+            extracted_df, messages = run_clustering(cluster_report_names, extracted_df, mode=clustering_mode, block_by=block_by)
+            # The sample is too small to reach the size cap, so say when the full run hit it
+            for message in messages:
+                st.warning(message)
         except Exception as e:
             st.error(f"Error clustering report names: {e}")
             return
@@ -141,10 +270,13 @@ def main():
         cols = [col for col in extracted_df.columns if col not in ['reportGroupId', 'originalPath']] + ['reportGroupId', 'originalPath']
         extracted_df = extracted_df[cols]
 
-        extracted_df['Region Assigner'] = extracted_df.apply(concat_first_words, axis=1)
-        extracted_df['Region'] = extracted_df['Region Assigner'].apply(assign_region)
-        extracted_df['Flag for Decommission'], extracted_df['reasonForFlagOfDecommission'] = zip(*extracted_df['originalPath'].apply(check_flags))
-        extracted_df['Business Unit'] = extracted_df['Search Path'].apply(assign_business_unit)
+        extracted_df['Region Assigner'] = concat_first_words(extracted_df)
+        try:
+            keywords = load_keywords(keywords_file or KEYWORDS_FILE)
+        except Exception as e:
+            st.error(f"Error reading keyword tables: {e}")
+            return
+        extracted_df = classify_paths(extracted_df, keywords)
 
         st.write("Extracted Data:")
         st.dataframe(extracted_df)
@@ -0,0 +1,195 @@
+# Dependency graph of a Framework Manager model, built from the FM extractor's output.
+# Query subjects point to their query items, query items point to the objects named in
+# their refobjs and shortcuts point to their target. Transitive dependencies and
+# dependents are memoised per object, so repeated lineage questions do not walk the
+# graph again.
+
+import json
+
+def object_id(*names):
+    """
+    Cognos reference of a model object, e.g. [Database Layer].[MATERIAL].[SUPER_BRAND_ID].
+    """
+    return '.'.join(f'[{name}]' for name in names)
+
+class ModelDependencyGraph:
+    """
+    Directed graph of model objects keyed by their Cognos reference.
+
+    nodes maps each object to its attributes (type, namespace, querySubject) and
+    edges maps it to the objects it references directly. References to objects
+    that are not defined in the model become nodes of type 'external'.
+    """
+
+    def __init__(self, nodes=None, edges=None):
+        self.nodes = dict(nodes or {})
+        self.edges = {node: list(targets) for node, targets in (edges or {}).items()}
+        self._reverse = None
+        self._dependencies = {}
+        self._dependents = {}
+
+    @classmethod
+    def from_namespaces(cls, namespaces):
+        """
+        Build the graph from parse_xml output (a list of namespaces).
+        """
+        graph = cls()
+        for namespace in namespaces:
+            for query in namespace['queries']:
+                graph.add_query_subject(namespace['name'], query['name'])
+                for item in query['queryItems']:
+                    graph.add_query_item(namespace['name'], query['name'], item['name'], item['refobjs'])
+            for shortcut in namespace['shortcuts']:
+                graph.add_shortcut(namespace['name'], shortcut['name'], shortcut['refobj'])
+        return graph
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Build the graph from iter_model_records output, without grouping by namespace first.
+        """
+        graph = cls()
+        for record in records:
+            graph.add_record(record)
+        return graph
+
+    def add_record(self, record):
+        if record['type'] == 'querySubject':
+            self.add_query_subject(record['namespace'], record['name'])
+        elif record['type'] == 'queryItem':
+            self.add_query_item(record['namespace'], record['querySubject'], record['name'], record['refobjs'])
+        elif record['type'] == 'shortcut':
+            self.add_shortcut(record['namespace'], record['name'], record['refobj'])
+
+    def add_node(self, node, **attributes):
+        # A node first seen as a reference gets its real attributes once it is defined
+        self.nodes[node] = attributes
+        self.edges.setdefault(node, [])
+        self._reset()
+
+    def add_edge(self, source, target):
+        for node in (source, target):
+            if node not in self.nodes:
+                self.nodes[node] = {'type': 'external'}
+                self.edges[node] = []
+        if target not in self.edges[source]:
+            self.edges[source].append(target)
+        self._reset()
+
+    def add_query_subject(self, namespace, name):
+        self.add_node(object_id(namespace, name), type='querySubject', namespace=namespace)
+
+    def add_query_item(self, namespace, query_subject, name, refobjs):
+        node = object_id(namespace, query_subject, name)
+        self.add_node(node, type='queryItem', namespace=namespace, querySubject=query_subject)
+        # A query subject is made of its items, so it depends on them and on what they reference
+        self.add_edge(object_id(namespace, query_subject), node)
+        for refobj in refobjs:
+            # The database layer has no refobjs and reports them as "N/A"
+            if refobj and refobj != "N/A":
+                self.add_edge(node, refobj.strip())
+
+    def add_shortcut(self, namespace, name, target):
+        node = object_id(namespace, name)
+        self.add_node(node, type='shortcut', namespace=namespace)
+        if target and target != "N/A":
+            self.add_edge(node, target.strip())
+
+    def _reset(self):
+        self._reverse = None
+        self._dependencies.clear()
+        self._dependents.clear()
+
+    def references(self, node):
+        """
+        Objects node refers to directly.
+        """
+        return list(self.edges.get(node, []))
+
+    def referenced_by(self, node):
+        """
+        Objects referring to node directly.
+        """
+        if self._reverse is None:
+            self._reverse = {source: [] for source in self.edges}
+            for source, targets in self.edges.items():
+                for target in targets:
+                    self._reverse[target].append(source)
+        return list(self._reverse.get(node, []))
+
+    def _closure(self, node, neighbours, memo):
+        # Graph walk that reuses the finished closure of any node it reaches; it stays
+        # correct when references form a cycle because only finished closures are reused
+        if node in memo:
+            return memo[node]
+        reached = set()
+        pending = list(neighbours(node))
+        while pending:
+            current = pending.pop()
+            if current in reached:
+                continue
+            reached.add(current)
+            if current in memo:
+                reached |= memo[current]
+            else:
+                pending.extend(neighbours(current))
+        reached.discard(node)
+        memo[node] = frozenset(reached)
+        return memo[node]
+
+    def dependencies(self, node):
+        """
+        Every object node depends on, directly or through other objects.
+        """
+        return self._closure(node, self.references, self._dependencies)
+
+    def dependents(self, node):
+        """
+        Every object that depends on node, directly or through other objects.
+        For a query subject this includes every object depending on one of its items,
+        e.g. the business layer subjects and shortcuts built on a database table.
+        """
+        reached = self._closure(node, self.referenced_by, self._dependents)
+        if self.nodes.get(node, {}).get('type') != 'querySubject':
+            return reached
+        # Items refer to the subject only through containment, so walk from each of them;
+        # the union is not memoised because the walks from other nodes must not reuse it
+        reached = set(reached)
+        for item in self.edges[node]:
+            if self.nodes[item].get('type') == 'queryItem':
+                reached |= self._closure(item, self.referenced_by, self._dependents)
+        reached.discard(node)
+        return frozenset(reached)
+
+    def depends_on(self, node, target):
+        return target in self.dependencies(node)
+
+    def precompute(self):
+        """
+        Fill the dependency and dependent indexes for every node up front.
+        """
+        for node in self.nodes:
+            self.dependencies(node)
+            self.dependents(node)
+
+    def save(self, path):
+        """
+        Write the nodes and adjacency lists to a JSON file.
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_json())
+
+    def to_json(self):
+        return json.dumps({'nodes': self.nodes, 'edges': self.edges}, indent=0)
+
+    @classmethod
+    def load(cls, source):
+        """
+        Reload a graph written by save() (a path or an open file), without the model XML.
+        """
+        if isinstance(source, str):
+            with open(source, encoding='utf-8') as f:
+                data = json.load(f)
+        else:
+            data = json.load(source)
+        return cls(data['nodes'], data['edges'])
@@ -2,12 +2,29 @@
 import streamlit as st
 import pandas as pd
 import re
+import numpy as np
+
+# Recipient columns of the granular report, and the email domains that count as internal
+RECIPIENT_COLUMNS = ['JobStepDefinition Recipients', 'Schedule Recipients', 'JobDefinition Recipients2']
+INTERNAL_DOMAINS = 'goodyear.com'
+EMAIL_DOMAIN_PATTERN = re.compile(r'@([\w.-]+)')
+
+# Join the values of each run of equal keys (keys must be sorted), e.g. recipients per report.
+# Slicing one list is much faster than a groupby with ','.join when there are many small groups
+def join_sorted_groups(keys, values, sep=','):
+    keys = np.asarray(keys)
+    values = list(values)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.array([], dtype=int)
+    ends = list(starts[1:]) + [len(values)]
+    return pd.Series([sep.join(values[start:end]) for start, end in zip(starts, ends)], index=keys[starts], dtype=object)
 
 # Streamlit app title
 st.title("JobName and ReportName Extractor with Granular Report")
 
 # File uploader for CSV
 uploaded_file = st.file_uploader("Choose a CSV file", type="csv")
+internal_domains = st.text_input("Internal email domains (comma separated)", value=INTERNAL_DOMAINS)
+internal_domains = {domain.strip().lower() for domain in internal_domains.split(',') if domain.strip()}
 
 if uploaded_file is not None:
     # Read the CSV file into a DataFrame
@@ -39,7 +56,20 @@ if uploaded_file is not None:
     pivot['JOBs'] = pivot['ReportName'].map(job_map)
 
     # Step 5: Populate 'JobDefinition Recipients2' using the job names
-    pivot['JobDefinition Recipients2'] = pivot['JOBs'].apply(lambda x: ','.join(df[df['Name'].isin(x.split(','))]['Recipient'].unique()) if isinstance(x, str) else '')
+    # Each (Name, Recipient) pair is kept once, at its first row, so the schedule is only
+    # scanned once. Each report's job list is exploded and joined to those pairs. A
+    # recipient keeps its first row over all the report's jobs, so the recipients come
+    # out in the same order as filtering the schedule rows for the report's jobs.
+    name_recipients = df[['Name', 'Recipient']].reset_index(drop=True).rename_axis('row').reset_index()
+    name_recipients = name_recipients.drop_duplicates(['Name', 'Recipient'])
+    report_jobs = pivot[['JOBs']].dropna().rename_axis('report').reset_index()
+    # astype(str) keeps .str usable when no report has jobs and the column is all NaN
+    report_jobs['Name'] = report_jobs['JOBs'].astype(str).str.split(',')
+    report_jobs = report_jobs.explode('Name').drop_duplicates(['report', 'Name'])
+    job_recipients = report_jobs[['report', 'Name']].merge(name_recipients, on='Name')
+    job_recipients = job_recipients.sort_values(['report', 'row']).drop_duplicates(['report', 'Recipient'])
+    recipients2 = join_sorted_groups(job_recipients['report'], job_recipients['Recipient'])
+    pivot['JobDefinition Recipients2'] = recipients2.reindex(pivot.index, fill_value='')
 
     # Step 6: Add 'SearchPath' (assuming it is the first non-null SearchPath for each ReportName)
     search_path_map = df.groupby('ReportName')['SearchPath'].first().to_dict()
@@ -64,17 +94,21 @@ if uploaded_file is not None:
     # Remove any leading or trailing commas that might occur from empty values
     pivot['all recipients'] = pivot['all recipients'].str.strip(',')
 
-    # Add the 'paginated flag' column based on email domain logic
-    def check_paginated_flag(recipients):
-        # Regex to extract all email domains
-        email_domains = re.findall(r'@([\w.-]+)', recipients)
-        # Check if any domain is not 'goodyear.com'
-        for domain in email_domains:
-            if domain.lower() != 'goodyear.com':
-                return 'yes'
-        return 'no'
-
-    pivot['paginated flag'] = pivot['all recipients'].apply(check_paginated_flag)
+    # Normalise the recipients once: one row per (report, recipient), split from the
+    # ','-joined recipient columns and stripped, with every email domain it contains
+    recipients = pivot[RECIPIENT_COLUMNS].stack().str.split(',').explode().str.strip()
+    recipients = recipients[recipients.ne('')].droplevel(-1).rename('Recipient').rename_axis('report').reset_index()
+    recipients = recipients.drop_duplicates()
+    domains = recipients['Recipient'].str.findall(EMAIL_DOMAIN_PATTERN).explode().dropna()
+    # A recipient is external if any of its domains is not an internal one
+    external_domain = ~domains.str.lower().isin(internal_domains)
+    recipients['External'] = external_domain.groupby(level=0).any().reindex(recipients.index, fill_value=False)
+
+    # Add the 'paginated flag' column (any external recipient) and the number of
+    # external recipients of each report, for sizing paginated capacity
+    external_counts = recipients.groupby('report')['External'].sum().reindex(pivot.index, fill_value=0)
+    pivot['paginated flag'] = np.where(external_counts > 0, 'yes', 'no')
+    pivot['external recipients'] = external_counts.astype(int)
 
     # Display the final granular DataFrame
     st.write("Granular Report DataFrame:")
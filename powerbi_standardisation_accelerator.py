@@ -2,26 +2,27 @@
 
 import streamlit as st
 import zipfile
-import io
+import argparse
+import copy
+import csv
+import functools
+import glob
 import json
+import os
+import re
+import struct
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Output archives are kept in memory up to this size and spill to a temp file beyond it
+SPOOL_MAX_SIZE = 64 * 1024 * 1024
+# Copy untouched entries in blocks of this size
+COPY_BLOCK_SIZE = 1024 * 1024
+# Zip extra field holding the 64-bit sizes; FileHeader() writes its own when it is needed
+ZIP64_EXTRA_ID = 0x0001
 
-st.title('PowerBI Accelerator by Sigmoid')
-
-# Upload the Source zip file
-ss = st.file_uploader('Upload a PBIX file')
-
-# --------- Removing Streamlit's Hamburger and Footer starts ---------
-hide_st_style = """
-            <style>
-            #MainMenu {visibility: hidden;}
-            footer {visibility: hidden;}
-            header {visibility: hidden;}
-            a {text-decoration: none;}
-            .css-15tx938 {font-size: 18px !important;}
-            </style>
-            """
-st.markdown(hide_st_style, unsafe_allow_html=True)
-# --------- Removing Streamlit's Hamburger and Footer ends ------------
 new_vc1 = {
     "id": 99999999,
     "x": 0,
@@ -113,272 +114,624 @@ simage=                            {
                     "tabOrder": 11000
                 }
 
-if ss:
-    #st.info('Select one of the option')
-    #radio=st.radio(' ', ['Add new Header','Update exisiting Header'])
-
-    if 1==1:
-        # In-memory byte stream to hold the destination zip file data
-        zip_data = io.BytesIO()
-
-        # Extract the files from the source zip file and re-zip them into a destination zip file
-        with zipfile.ZipFile(ss, 'r') as source_zip:
-            with zipfile.ZipFile(zip_data, 'w') as destination_zip:
-                # Iterate over the files in the source zip file
-                for name in source_zip.namelist():
-
-                    # Skip the Security Binding file
-                    if name == 'SecurityBindings':
-                        continue
-
-                    # Manipulate the Layout file
-                    if name == 'Report/Layout':
-                        # Read the contents of the layout file
-                        data = source_zip.read(name).decode('utf-16 le')
-                        # Old layout file
-                        with open('app-og.json', 'w') as f:
-                            a=json.loads(data)
-                            json.dump(a, f)
-                        try:
-                            data=json.loads(data)
-                            ##### Changing attributes of certain elements
-                            for section in data['sections']:
-                                # print(section,'section')
-                                section['visualContainers'].append(new_vc1)
-                                section['visualContainers'].append(new_vc2)
-                                section['visualContainers'].append(footer_text)
-                                section['visualContainers'].append(footer_box)
-                                section['visualContainers'].append(ibutton)
-                                section['visualContainers'].append(source_text)
-                                section['visualContainers'].append(simage)
-                                if section['ordinal'] == 0:  # Checking if it's the first page
-                                    for visual in section['visualContainers']:
-                                         # Load the config dictionary from the JSON string
-                                        config = json.loads(visual['config'])
-
-                                        try:
-                                            config['singleVisual']['vcObjects']['title'][0]['properties']['fontFamily']['expr']['Literal']['Value']="'Segoe UI'"
-                                            config['singleVisual']['vcObjects']['title'][0]['properties']['fontSize']['expr']['Literal']['Value']=16
-                                            visual['config']=json.dumps(config)
-                                            #st.write(visual['config'])
-                                        except:
-                                                print('tested')
-
-                                        # Application 2 - Changing position of line chart
-                                        if config['singleVisual']['visualType'] == 'lineChart':
-                                            #st.write('found line chart in page 1')
-                                        
-                                            # Update main dictionary values
-                                            visual['x'] = 886
-                                            visual['y'] = 255
-                                            visual['width'] = 373
-                                            visual['height'] = 363
-                                            for layout in config['layouts']:
-                                                # Update the values in the config dictionary
-                                                #st.write('inside config dict')
-                                                layout['position']['x'] = 886
-                                                layout['position']['y'] = 255
-                                                layout['position']['width'] = 373
-                                                layout['position']['height'] = 363
-                                                #st.write(layout['position']['x'],layout['position']['y'])
-                                        visual['config']=json.dumps(config)
-                                        #st.write(visual['config'])
-                                        
-                                        # Pie chart
-                                        if config['singleVisual']['visualType'] == 'tableEx':
-                                            #st.write('found pie chart in page 1')
-                                        
-                                            # Update main dictionary values
-                                            visual['x'] = 20
-                                            visual['y'] = 186
-                                            visual['width'] = 1239
-                                            visual['height'] = 453
-                                            for layout in config['layouts']:
-                                                # Update the values in the config dictionary
-                                                #st.write('inside config dict')
-                                                layout['position']['x'] = 20
-                                                layout['position']['y'] = 186
-                                                layout['position']['width'] = 1239
-                                                layout['position']['height'] = 453
-                                                #st.write(layout['position']['x'],layout['position']['y'])
-                                        visual['config']=json.dumps(config)
-                                        #st.write(visual['config'])
-
-                                        # Bar chart
-                                        if config['singleVisual']['visualType'] == 'barChart':
-                                            #st.write('found bar chart in page 1')
-                                        
-                                            # Update main dictionary values
-                                            visual['x'] = 19
-                                            visual['y'] = 255
-                                            visual['width'] = 407
-                                            visual['height'] = 362
-                                            for layout in config['layouts']:
-                                                # Update the values in the config dictionary
-                                                #st.write('inside config dict')
-                                                layout['position']['x'] = 19
-                                                layout['position']['y'] = 255
-                                                layout['position']['width'] = 407
-                                                layout['position']['height'] = 362
-                                                #st.write(layout['position']['x'],layout['position']['y'])
-                                        visual['config']=json.dumps(config)
-                                        #st.write(visual['config'])
-
-                                        # try:
-                                        #     st.write(config['singleVisual']['vcObjects']['title'][0]['properties']['fontFamily']['expr']['Literal']['Value'])
-                                        # except:
-                                        #     st.write('huh')
-                                        # if 'fontFamily' in config['singleVisual']['objects']['general'][0]['properties']:
-                                        #     st.write('hi')
-                                        #     visual['config']=json.dumps(config)
-                                        #     st.write('Diff font found')
-                                        #     st.write(config['singleVisual']['objects']['general'][0]['properties']['fontFamily']['expr']['Literal']['Value'])
-                                        #     # Update the config in the visual container
-                                        #     visual['config'] = json.dumps(config)
-                                        #     st.write(visual['config'])
-
-                                else:
-                                    for visual in section['visualContainers']:
-                                        config = json.loads(visual['config'])
-                                        try:
-                                            #st.write('inside second page')
-                                            config['singleVisual']['vcObjects']['title'][0]['properties']['fontFamily']['expr']['Literal']['Value']="'Segoe UI'"
-                                            config['singleVisual']['vcObjects']['title'][0]['properties']['fontSize']['expr']['Literal']['Value']=16
-                                            visual['config']=json.dumps(config)
-                                            #st.write(visual['config'])
-                                        except:
-                                            print('tested')
-                            # New Layout file
-                            with open('app-generated.json', 'w') as f:
-                                json.dump(data, f)
-                        
-                        except:
-                            print('hi')
-                        # Add the manipulated layout data to the destination zip file
-                        data = json.dumps(data)
-                        destination_zip.writestr(name, data.encode('utf-16 le'))
-                    
-                    else:
-                        # Add the file to the destination zip file as-is
-                        binary_data = source_zip.read(name)
-                        destination_zip.writestr(name, binary_data)
 
+# Rule files shipped next to this script
+RULES_DIR = os.path.dirname(os.path.abspath(__file__))
+STANDARDISE_RULES = os.path.join(RULES_DIR, 'pbix_standardise_rules.json')
+HEADER_CLEANUP_RULES = os.path.join(RULES_DIR, 'pbix_header_cleanup_rules.json')
+# visualType read straight from the raw config string, so choosing candidate rules needs no JSON decoding
+VISUAL_TYPE_PATTERN = re.compile(r'"visualType"\s*:\s*"([^"]*)"')
+
+class VisualContainer:
+    """
+    One entry of a section's visualContainers. The JSON-string fields (config,
+    filters, query, dataTransforms) are decoded at most once, edits are made on
+    the decoded values, and flush() writes back only the fields that changed.
+    """
+    JSON_FIELDS = ('config', 'filters', 'query', 'dataTransforms')
+
+    def __init__(self, visual):
+        self.visual = visual
+        self._decoded = {}
+        self._dirty_fields = set()
+
+    @property
+    def dirty(self):
+        return bool(self._dirty_fields)
+
+    def field(self, name):
+        """
+        Decoded value of one of the JSON_FIELDS (None when the visual does not have it).
+        """
+        if name not in self._decoded:
+            raw = self.visual.get(name)
+            self._decoded[name] = json.loads(raw) if raw is not None else None
+        return self._decoded[name]
+
+    def raw(self, name):
+        """
+        JSON string of a field, re-serialised first if it was changed.
+        """
+        if name in self._dirty_fields:
+            self.flush()
+        return self.visual.get(name) or ''
+
+    @property
+    def config(self):
+        return self.field('config')
+
+    @property
+    def visual_type(self):
+        # Groups have singleVisualGroup instead of singleVisual, so they have no visual type
+        if 'config' in self._decoded:
+            return self.config.get('singleVisual', {}).get('visualType')
+        match = VISUAL_TYPE_PATTERN.search(self.raw('config'))
+        return match.group(1) if match else None
+
+    def mark_dirty(self, name='config'):
+        self._dirty_fields.add(name)
+
+    def set_position(self, **position):
+        """
+        Set x, y, z, width and/or height on the container and on every layout in its config.
+        """
+        self.visual.update(position)
+        for layout in self.config.get('layouts', []):
+            layout['position'].update(position)
+        self.mark_dirty()
+
+    def targets(self, path):
+        """
+        (parent, key) pairs addressed by a dotted path such as 'y' or
+        'config.singleVisual.vcObjects.title.0.properties'. A path starting with one
+        of the JSON_FIELDS walks into its decoded value; '*' walks every list item.
+        Parents that do not exist are skipped.
+        """
+        keys = split_path(path)
+        if keys[0] in self.JSON_FIELDS and len(keys) > 1:
+            nodes = [self.field(keys[0])]
+            keys = keys[1:]
+        else:
+            nodes = [self.visual]
+        for key in keys[:-1]:
+            children = []
+            for node in nodes:
+                if isinstance(node, dict):
+                    if key in node:
+                        children.append(node[key])
+                elif isinstance(node, list):
+                    children.extend(node[index] for index in path_indexes(node, key))
+            nodes = children
+        return [(node, keys[-1]) for node in nodes if isinstance(node, (dict, list))]
+
+    def values(self, path):
+        return [child for node, key in self.targets(path) for child in path_children(node, key)]
+
+    def set_value(self, path, value):
+        """
+        Set every existing parent's key to value. Returns the number of values set.
+        """
+        count = 0
+        for node, key in self.targets(path):
+            if isinstance(node, dict):
+                node[key] = value
+                count += 1
+            else:
+                for index in path_indexes(node, key):
+                    node[index] = value
+                    count += 1
+        field = split_path(path)[0]
+        if count and field in self.JSON_FIELDS and '.' in path:
+            self.mark_dirty(field)
+        return count
+
+    def flush(self):
+        """
+        Serialise the changed fields back into the visual dictionary.
+        """
+        for name in self._dirty_fields:
+            self.visual[name] = json.dumps(self._decoded[name])
+        self._dirty_fields.clear()
+
+@functools.lru_cache(maxsize=None)
+def split_path(path):
+    return tuple(path.split('.'))
+
+def path_indexes(node, key):
+    if key == '*':
+        return range(len(node))
+    if key.lstrip('-').isdigit() and -len(node) <= int(key) < len(node):
+        return [int(key)]
+    return []
+
+def path_children(node, key):
+    if isinstance(node, list):
+        return [node[index] for index in path_indexes(node, key)]
+    if isinstance(node, dict) and key in node:
+        return [node[key]]
+    return []
+
+# Comparisons allowed in a rule's "where" conditions
+CONDITION_OPERATORS = {
+    'equals': lambda value, expected: value == expected,
+    'notEquals': lambda value, expected: value != expected,
+    'greaterThan': lambda value, expected: isinstance(value, (int, float)) and value > expected,
+    'lessThan': lambda value, expected: isinstance(value, (int, float)) and value < expected,
+    'contains': lambda value, expected: isinstance(value, str) and expected in value,
+    'in': lambda value, expected: value in expected,
+}
 
-        # Download the destination file
-        st.download_button(
-            label='Download Destination PBIX File',
-            data=zip_data.getvalue(),
-            file_name='destination.pbix',
-            mime='application/pbix'
-        )
-    elif 1==2:
-        # In-memory byte stream to hold the destination zip file data
-        zip_data = io.BytesIO()
-
-        # Extract the files from the source zip file and re-zip them into a destination zip file
-        with zipfile.ZipFile(ss, 'r') as source_zip:
-            with zipfile.ZipFile(zip_data, 'w') as destination_zip:
-                # Iterate over the files in the source zip file
-                for name in source_zip.namelist():
-
-                    # Skip the Security Binding file
-                    if name == 'SecurityBindings':
-                        continue
-
-                    # Manipulate the Layout file
-                    if name == 'Report/Layout':
-                        # Read the contents of the layout file
-                        data = source_zip.read(name).decode('utf-16 le')
-
-                        # Old layout file
-                        with open('og_file.json', 'w') as f:
-                            a=json.loads(data)
-                            json.dump(a, f)
-                        try:
-                            ##### Removing certain elements
-                            data=json.loads(data)
-                            for section in data['sections']:
-                                print(section)
-
-                                # Create a new list of visual containers that don't meet the condition
-                                new_visual_containers = []
-                                for visualContainer in section['visualContainers']:
-                                    # Check if y is 0 and x is >500 and config contains "parallelogram" or "rectangle"
-                                    if visualContainer['y'] == 0 and visualContainer['x'] > 500 and ("parallelogram" in visualContainer['config'] or "rectangle" in visualContainer['config']):
-                                        continue
-                                    else:
-                                        new_visual_containers.append(visualContainer)
-
-                                # Replace the old list with the new list
-                                section['visualContainers'] = new_visual_containers
-                            
-                            ##### Changing attributes of certain elements
-                            for section in data['sections']:
-                                for visualContainer in section['visualContainers']:
-
-                                    # Changing Header rectangle
-                                    if visualContainer['y'] == 0 and "#004E90" in visualContainer['config'] :
-                                        # Change x, height, and width
-                                        visualContainer['x'] = 0
-                                        visualContainer['height'] = 65
-                                        visualContainer['width'] = 1280
-                                        # Change config
-                                        config = json.loads(visualContainer['config'])
-
-                                        # Parallelogram to Rectangle
-                                        # Replace "parallelogram" with "rectangle" in the "config" key's value
-                                        config["singleVisual"]["objects"]["shape"][0]["properties"]["tileShape"]["expr"]["Literal"]["Value"] = "'rectangle'"
-
-                                        for layout in config['layouts']:
-                                            layout['position']['x'] = 0
-                                            layout['position']['height'] = 65
-                                            layout['position']['width'] = 1280 
-                                        visualContainer['config'] = json.dumps(config)
-
-                                    # Changing z of logo
-                                    if visualContainer['y'] == 0 and "Pepsico_4659666136978873.png" in visualContainer['config']:
-                                        visualContainer['z'] = 50000
-                                        # Change config
-                                        config = json.loads(visualContainer['config'])
-                                        for layout in config['layouts']:
-                                            layout['position']['z'] = 50000
-                                        visualContainer['config'] = json.dumps(config)
-
-                                    # Changing attributes of groups
-                                    if visualContainer['y'] == 0 and "singleVisualGroup" in visualContainer['config']:
-                                        visualContainer['x'] = 0
-                                        visualContainer['height'] = 65
-                                        visualContainer['width'] = 1280
-                                        # Change config
-                                        config = json.loads(visualContainer['config'])
-                                        for layout in config['layouts']:
-                                            layout['position']['x'] = 0
-                                            layout['position']['height'] = 65
-                                            layout['position']['width'] = 1280
-                                        visualContainer['config'] = json.dumps(config)
-                            
-                            # New Layout file
-                            with open('updated_file.json', 'w') as f:
-                                json.dump(data, f)
-                        
-                        except:
-                            print('hi')
-                        # Add the manipulated layout data to the destination zip file
-                        data = json.dumps(data)
-                        destination_zip.writestr(name, data.encode('utf-16 le'))
-                    
-                    else:
-                        # Add the file to the destination zip file as-is
-                        binary_data = source_zip.read(name)
-                        destination_zip.writestr(name, binary_data)
-
+def as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+class StandardisationRule:
+    """
+    A match predicate plus the patches applied to every visual it matches.
+
+    Predicate keys (all optional, all must hold):
+        visualType      - a visual type or a list of them
+        page            - a page ordinal or a list of them
+        configContains  - substring(s) of the raw config string, any one is enough
+        where           - list of {"path": ..., <operator>: value} conditions, where the
+                          operator is one of CONDITION_OPERATORS or "exists": true/false
+    Patch keys:
+        remove          - drop the visual from the page
+        position        - x/y/z/width/height for the container and its config layouts
+        set             - {path: value} for any other property
+    """
+
+    def __init__(self, spec, order=0):
+        self.name = spec.get('name', f'rule {order + 1}')
+        self.order = order
+        self.visual_types = as_list(spec.get('visualType'))
+        self.pages = as_list(spec.get('page'))
+        self.config_contains = as_list(spec.get('configContains'))
+        self.where = spec.get('where', [])
+        self.remove = spec.get('remove', False)
+        self.position = spec.get('position', {})
+        self.patches = spec.get('set', {})
+        for condition in self.where:
+            operators = set(condition) - {'path'}
+            unknown = operators - set(CONDITION_OPERATORS) - {'exists'}
+            if 'path' not in condition or len(operators) != 1 or unknown:
+                raise ValueError(f"Rule '{self.name}': invalid condition {condition}")
+        self.hits = 0
+        self.seconds = 0.0
+
+    def condition_holds(self, container, condition):
+        values = container.values(condition['path'])
+        if 'exists' in condition:
+            return bool(values) == bool(condition['exists'])
+        operator, expected = next((key, value) for key, value in condition.items() if key != 'path')
+        return any(CONDITION_OPERATORS[operator](value, expected) for value in values)
+
+    def matches(self, container):
+        # The visual type and page are already guaranteed by the engine's index
+        if self.config_contains:
+            raw_config = container.raw('config')
+            if not any(text in raw_config for text in self.config_contains):
+                return False
+        return all(self.condition_holds(container, condition) for condition in self.where)
+
+    def apply(self, container):
+        """
+        Patch the visual. Returns True when the visual should be removed.
+        """
+        if self.remove:
+            return True
+        if self.position:
+            container.set_position(**self.position)
+        for path, value in self.patches.items():
+            container.set_value(path, value)
+        return False
+
+def load_rules(source):
+    """
+    Read the rule list from a JSON or YAML file (a path or an uploaded file). The
+    file holds either a list of rules or {"rules": [...]}.
+    """
+    name = source if isinstance(source, str) else getattr(source, 'name', '')
+    if isinstance(source, str):
+        with open(source, encoding='utf-8') as f:
+            text = f.read()
+    else:
+        text = source.read()
+        text = text.decode('utf-8') if isinstance(text, bytes) else text
+    if name.lower().endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError('PyYAML is needed to read YAML rule files (pip install pyyaml)')
+        spec = yaml.safe_load(text)
+    else:
+        spec = json.loads(text)
+    return spec['rules'] if isinstance(spec, dict) else spec
+
+class RuleEngine:
+    """
+    Run a list of StandardisationRule over every visual of a layout.
+
+    Rules are indexed by visual type and page ordinal, so each visual is only
+    checked against the rules that can apply to it, in file order. Every rule
+    keeps a hit count and the time spent matching and applying it.
+    """
+
+    def __init__(self, rules):
+        self.rules = [rule if isinstance(rule, StandardisationRule) else StandardisationRule(rule, order)
+                      for order, rule in enumerate(rules)]
+        # (visual type, page) -> rules, with None standing for "any"
+        self._index = {}
+        for rule in self.rules:
+            for visual_type in rule.visual_types or [None]:
+                for page in rule.pages or [None]:
+                    self._index.setdefault((visual_type, page), []).append(rule)
+        self._uses_visual_type = any(rule.visual_types for rule in self.rules)
+        self._candidates = {}
+        # Visual counts of all the runs so far
+        self.visuals_checked = 0
+        self.visuals_moved = 0
+        self.visuals_removed = 0
+
+    @classmethod
+    def from_file(cls, source):
+        return cls(load_rules(source))
+
+    def candidates(self, visual_type, page):
+        key = (visual_type, page)
+        if key not in self._candidates:
+            rules = {}
+            for index_key in [(visual_type, page), (visual_type, None), (None, page), (None, None)]:
+                for rule in self._index.get(index_key, []):
+                    rules[rule.order] = rule
+            self._candidates[key] = [rules[order] for order in sorted(rules)]
+        return self._candidates[key]
+
+    def run(self, data):
+        """
+        Apply the rules to a parsed Report/Layout in place.
+        """
+        for section in data['sections']:
+            page = section.get('ordinal')
+            kept = []
+            for visual in section['visualContainers']:
+                container = VisualContainer(visual)
+                visual_type = container.visual_type if self._uses_visual_type else None
+                removed = moved = False
+                for rule in self.candidates(visual_type, page):
+                    started = time.perf_counter()
+                    if rule.matches(container):
+                        rule.hits += 1
+                        removed = rule.apply(container)
+                        moved = moved or bool(rule.position)
+                    rule.seconds += time.perf_counter() - started
+                    if removed:
+                        break
+                # Written back once per visual, and only when something changed
+                container.flush()
+                self.visuals_checked += 1
+                if removed:
+                    self.visuals_removed += 1
+                else:
+                    self.visuals_moved += moved
+                    kept.append(visual)
+            section['visualContainers'] = kept
+        return data
+
+    def stats(self):
+        """
+        Per-rule hit count and timing of all the runs so far.
+        """
+        return [{'Rule': rule.name, 'Hits': rule.hits, 'Seconds': round(rule.seconds, 4)} for rule in self.rules]
+
+def standardise_layout(data, engine=None):
+    """
+    Add the standard header, footer and logo visuals to every page, then apply the
+    standardisation rules (pbix_standardise_rules.json by default).
+    """
+    for section in data['sections']:
+        # Copies, because the rules edit the added visuals in place and the templates serve every page and file
+        section['visualContainers'].append(copy.deepcopy(new_vc1))
+        section['visualContainers'].append(copy.deepcopy(new_vc2))
+        section['visualContainers'].append(copy.deepcopy(footer_text))
+        section['visualContainers'].append(copy.deepcopy(footer_box))
+        section['visualContainers'].append(copy.deepcopy(ibutton))
+        section['visualContainers'].append(copy.deepcopy(source_text))
+        section['visualContainers'].append(copy.deepcopy(simage))
+    (engine or RuleEngine.from_file(STANDARDISE_RULES)).run(data)
+
+def clean_header_layout(data, engine=None):
+    """
+    Remove the extra header shapes and stretch the existing header, logo and groups
+    across the top of every page (pbix_header_cleanup_rules.json by default).
+    """
+    (engine or RuleEngine.from_file(HEADER_CLEANUP_RULES)).run(data)
+
+def strip_zip64_extra(extra):
+    """
+    Drop the zip64 block from a zip extra field, keeping every other block as is.
+    """
+    kept = b''
+    position = 0
+    while position + 4 <= len(extra):
+        block_id, block_size = struct.unpack('<HH', extra[position:position + 4])
+        block_end = position + 4 + block_size
+        if block_id != ZIP64_EXTRA_ID:
+            kept += extra[position:block_end]
+        position = block_end
+    return kept
+
+def copy_raw_entry(source_zip, destination_zip, info):
+    """
+    Copy one entry between open zip files without decompressing it. The compressed
+    bytes are streamed block by block, so the entry keeps its original compression
+    method and CRC and is never held in memory as a whole.
+    """
+    source_fp = source_zip.fp
+    source_fp.seek(info.header_offset)
+    local_header = source_fp.read(zipfile.sizeFileHeader)
+    # File name and extra field lengths of the local header (they can differ from the central directory)
+    name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+    source_fp.seek(info.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+
+    new_info = copy.copy(info)
+    new_info.extra = strip_zip64_extra(info.extra)
+    # Sizes and CRC are already known, so they go in the local header instead of a data descriptor
+    new_info.flag_bits &= ~0x08
+    destination_fp = destination_zip.fp
+    new_info.header_offset = destination_fp.tell()
+    destination_fp.write(new_info.FileHeader())
+
+    remaining = info.compress_size
+    while remaining:
+        block = source_fp.read(min(remaining, COPY_BLOCK_SIZE))
+        if not block:
+            raise zipfile.BadZipFile(f'Truncated entry {info.filename}')
+        destination_fp.write(block)
+        remaining -= len(block)
+
+    destination_zip.filelist.append(new_info)
+    destination_zip.NameToInfo[new_info.filename] = new_info
+    destination_zip.start_dir = destination_fp.tell()
+    destination_zip._didModify = True
+
+def write_layout_snapshot(diagnostics_dir, file_name, layout_text):
+    """
+    Save a layout JSON string as it is (no re-serialisation) for diagnostics.
+    """
+    with open(os.path.join(diagnostics_dir, file_name), 'w', encoding='utf-8') as f:
+        f.write(layout_text)
+
+def new_diagnostics_dir():
+    """
+    Fresh directory for one run's layout snapshots, so concurrent runs never share files.
+    """
+    return tempfile.mkdtemp(prefix='pbix_diagnostics_')
+
+def rewrite_pbix(source, edit_layout, diagnostics_dir=None, output=None):
+    """
+    Copy a PBIX/PBIT archive, passing its parsed Report/Layout to edit_layout.
+    With diagnostics_dir set, the layout text before and after the edit is saved
+    there as layout_original.json and layout_generated.json.
+
+    Only the layout is decompressed; every other entry (DataModel, StaticResources...)
+    is copied raw with its original compression and SecurityBindings is dropped.
+    The archive is written to output, a spooled temp file by default, which is
+    returned rewound to the start. An error while parsing or editing the layout is
+    raised, so no partially edited archive is returned.
+    """
+    if output is None:
+        output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+
+    with zipfile.ZipFile(source, 'r') as source_zip:
+        with zipfile.ZipFile(output, 'w') as destination_zip:
+            # Iterate over the files in the source zip file
+            for info in source_zip.infolist():
+
+                # Skip the Security Binding file
+                if info.filename == 'SecurityBindings':
+                    continue
+
+                # Manipulate the Layout file
+                if info.filename == 'Report/Layout':
+                    # Read the contents of the layout file
+                    data = source_zip.read(info).decode('utf-16 le')
+                    # Old layout file, straight from the text that was read
+                    if diagnostics_dir:
+                        write_layout_snapshot(diagnostics_dir, 'layout_original.json', data)
+                    try:
+                        data = json.loads(data)
+                        edit_layout(data)
+                    except Exception as e:
+                        raise ValueError(f'Report/Layout could not be edited: {type(e).__name__}: {e}') from e
+                    # Add the manipulated layout data to the destination zip file, compressed like the source entry
+                    data = json.dumps(data)
+                    # New Layout file, reusing the text written to the archive
+                    if diagnostics_dir:
+                        write_layout_snapshot(diagnostics_dir, 'layout_generated.json', data)
+                    layout_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                    layout_info.compress_type = info.compress_type
+                    destination_zip.writestr(layout_info, data.encode('utf-16 le'))
+
+                else:
+                    # Add the file to the destination zip file as-is
+                    copy_raw_entry(source_zip, destination_zip, info)
+
+    output.seek(0)
+    return output
+
+# Layout edit and default rule file of each batch mode
+BATCH_MODES = {
+    'standardise': (standardise_layout, STANDARDISE_RULES),
+    'header-cleanup': (clean_header_layout, HEADER_CLEANUP_RULES),
+}
+# Columns of the batch manifest, one row per input file
+MANIFEST_COLUMNS = ['File', 'Output', 'Pages', 'Visuals Added', 'Visuals Moved', 'Visuals Removed', 'Seconds', 'Bytes In', 'Bytes Out', 'Error']
+
+def count_visuals(data):
+    return sum(len(section['visualContainers']) for section in data['sections'])
+
+def collect_pbix_files(inputs, suffix):
+    """
+    Expand directories and glob patterns into the list of .pbix/.pbit files.
+    Outputs of an earlier run (names ending with suffix) are left out.
+    """
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for extension in ('pbix', 'pbit'):
+                files.extend(glob.glob(os.path.join(item, '**', f'*.{extension}'), recursive=True))
+        else:
+            files.extend(path for path in glob.glob(item, recursive=True) if os.path.isfile(path))
+    return sorted(path for path in set(files) if not os.path.splitext(path)[0].endswith(suffix))
+
+def output_path_for(path, suffix):
+    stem, extension = os.path.splitext(path)
+    return stem + suffix + extension
+
+def standardise_file(task):
+    """
+    Rewrite one PBIX/PBIT next to its input (run in a worker process).
+    Returns the manifest row and the rule stats of the file.
+    """
+    path, output, mode, rules_path, diagnostics_dir = task
+    edit_layout, default_rules = BATCH_MODES[mode]
+    row = dict.fromkeys(MANIFEST_COLUMNS, 0)
+    row.update({'File': path, 'Output': output, 'Error': ''})
+    started = time.perf_counter()
+    engine = None
+    try:
+        row['Bytes In'] = os.path.getsize(path)
+        engine = RuleEngine.from_file(rules_path or default_rules)
+        if diagnostics_dir:
+            os.makedirs(diagnostics_dir, exist_ok=True)
+        counts = {}
+
+        def edit(data):
+            visuals_before = count_visuals(data)
+            edit_layout(data, engine=engine)
+            counts['Pages'] = len(data['sections'])
+            counts['Visuals Added'] = count_visuals(data) - visuals_before + engine.visuals_removed
+
+        with open(output, 'wb') as destination:
+            rewrite_pbix(path, edit, diagnostics_dir, output=destination)
+        row.update(counts)
+        row['Visuals Moved'] = engine.visuals_moved
+        row['Visuals Removed'] = engine.visuals_removed
+        row['Bytes Out'] = os.path.getsize(output)
+        if not counts:
+            # Layout errors are raised by rewrite_pbix, so only a missing layout gets here
+            row['Error'] = 'Report/Layout missing'
+    except Exception as e:
+        row['Error'] = f'{type(e).__name__}: {e}'
+        if os.path.exists(output):
+            os.remove(output)
+    row['Seconds'] = round(time.perf_counter() - started, 3)
+    return row, engine.stats() if engine else []
+
+def batch_main(argv=None):
+    parser = argparse.ArgumentParser(description="Standardise many PBIX/PBIT files without the Streamlit UI.")
+    parser.add_argument('inputs', nargs='+', help="Directories or glob patterns of .pbix/.pbit files")
+    parser.add_argument('--mode', choices=sorted(BATCH_MODES), default='standardise', help="Layout edit to apply")
+    parser.add_argument('--rules', default=None, help="JSON/YAML rule file (default: the rule file of the mode)")
+    parser.add_argument('--suffix', default='_standardised', help="Added to each input name to name its output")
+    parser.add_argument('--manifest', default='standardisation_manifest.csv', help="CSV file receiving one row per input file")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument('--diagnostics', action='store_true', help="Save each layout before and after the edit in a temp directory")
+    args = parser.parse_args(argv)
+
+    # Fail before starting the workers when the rule file is invalid
+    if args.rules:
+        RuleEngine.from_file(args.rules)
+    files = collect_pbix_files(args.inputs, args.suffix)
+    if not files:
+        print("No PBIX/PBIT files found.")
+        return 1
+    # One snapshot folder per file inside a directory of this run
+    diagnostics_root = new_diagnostics_dir() if args.diagnostics else None
+    tasks = [(path, output_path_for(path, args.suffix), args.mode, args.rules,
+              os.path.join(diagnostics_root, f'{number:04d}_{os.path.basename(path)}') if diagnostics_root else None)
+             for number, path in enumerate(files)]
+
+    failed = 0
+    rule_totals = {}
+    with open(args.manifest, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=MANIFEST_COLUMNS)
+        writer.writeheader()
+        # One file per task: PBIX files are large and uneven, so there is nothing to gain from batching them
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            for row, rule_stats in executor.map(standardise_file, tasks):
+                writer.writerow(row)
+                failed += bool(row['Error'])
+                for stat in rule_stats:
+                    total = rule_totals.setdefault(stat['Rule'], {'Hits': 0, 'Seconds': 0.0})
+                    total['Hits'] += stat['Hits']
+                    total['Seconds'] += stat['Seconds']
+
+    for rule, total in rule_totals.items():
+        print(f"{rule}: {total['Hits']} hits in {total['Seconds']:.3f} s")
+    print(f"Standardised {len(files) - failed} of {len(files)} files; {failed} failed (see {args.manifest}).")
+    if diagnostics_root:
+        print(f"Layout snapshots saved in {diagnostics_root}")
+    return 0
+
+def main():
+    st.title('PowerBI Accelerator by Sigmoid')
+
+    # Upload the Source zip file
+    ss = st.file_uploader('Upload a PBIX file')
+    # Optional house-style rules replacing the default rule file
+    rules_file = st.file_uploader('Upload a rules file (optional)', type=['json', 'yaml', 'yml'])
+    # Layout snapshots are only needed when debugging a rule
+    save_snapshots = st.checkbox('Save layout snapshots (diagnostics)')
+
+    # --------- Removing Streamlit's Hamburger and Footer starts ---------
+    hide_st_style = """
+            <style>
+            #MainMenu {visibility: hidden;}
+            footer {visibility: hidden;}
+            header {visibility: hidden;}
+            a {text-decoration: none;}
+            .css-15tx938 {font-size: 18px !important;}
+            </style>
+            """
+    st.markdown(hide_st_style, unsafe_allow_html=True)
+    # --------- Removing Streamlit's Hamburger and Footer ends ------------
+
+    if ss:
+        # Same modes as batch mode, each with its layout edit and default rule file
+        mode = st.radio('Select one of the option', list(BATCH_MODES))
+        edit_layout, default_rules = BATCH_MODES[mode]
+
+        diagnostics_dir = new_diagnostics_dir() if save_snapshots else None
+        try:
+            engine = RuleEngine.from_file(rules_file or default_rules)
+        except Exception as e:
+            st.error(f'Error reading the rules file: {e}')
+            return
+        try:
+            output = rewrite_pbix(ss, functools.partial(edit_layout, engine=engine), diagnostics_dir)
+        except Exception as e:
+            st.error(f'Error standardising the PBIX file: {e}')
+            return
+
+        # Rule hits and timings of this run
+        st.dataframe(engine.stats())
+        if diagnostics_dir:
+            st.info(f'Layout snapshots saved in {diagnostics_dir}')
 
         # Download the destination file
         st.download_button(
             label='Download Destination PBIX File',
-            data=zip_data.getvalue(),
+            data=output.read(),
             file_name='destination.pbix',
             mime='application/pbix'
         )
+
+if __name__ == "__main__":
+    # Any command-line arguments switch to the headless batch mode
+    if len(sys.argv) > 1:
+        sys.exit(batch_main(sys.argv[1:]))
     else:
-        print('')
+        main()
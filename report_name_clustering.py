@@ -0,0 +1,240 @@
+# Shared helper for grouping similar report names without a dense n x n distance matrix.
+# Average-linkage clusters can only merge rows that have at least one neighbour closer
+# than the threshold, so clustering each connected component of the sparse
+# "cosine distance <= threshold" graph on its own gives the same groups as
+# clustering everything at once, while memory is bounded by the largest component.
+# A component above the size cap is reduced to its distinct rows, which average
+# linkage still clusters exactly from their weighted mean vectors. Only with too many
+# distinct rows is it split at a tighter radius and merged again, which no longer
+# matches exact mode for those rows; callers are warned when that happens.
+# Given block keys (e.g. a folder), rows are only ever compared within their block,
+# which no longer matches exact mode but bounds the work by the largest block.
+
+import warnings
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from sklearn.cluster import AgglomerativeClustering
+from sklearn.metrics import pairwise_distances
+
+# Most similarities held at once while looking for neighbours (a chunk of rows times the block)
+MAX_CHUNK_ENTRIES = 2 ** 23
+# Oversized components are split again at this fraction of the radius, down to duplicates only
+SPLIT_RADIUS_FACTOR = 0.7
+MIN_SPLIT_RADIUS = 0.02
+# Largest component clustered densely as it is
+MAX_BLOCK_SIZE = 5000
+# Help text of the 'sparse' clustering mode, shared by the Streamlit apps
+SPARSE_MODE_HELP = (f"'sparse' avoids a full distance matrix and gives the same groups as 'exact' unless a group of "
+                    f"similar names has more than {MAX_BLOCK_SIZE} distinct names, where the groups are approximate")
+
+class ApproximateClusteringWarning(UserWarning):
+    """
+    Some report groups were split and merged again because they exceeded max_block_size.
+    """
+
+def block_members(blocks):
+    """
+    Row positions of each block, in order of the sorted block keys.
+    """
+    _, codes = np.unique(np.asarray(blocks), return_inverse=True)
+    order = np.argsort(codes, kind='stable')
+    boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+    return np.split(order, boundaries)
+
+def merge_links(components, rows, cols):
+    """
+    Component labels after linking each rows[i] to cols[i].
+    """
+    n = len(components)
+    graph = csr_matrix((np.ones(len(rows), dtype=np.int8), (components[rows], components[cols])), shape=(n, n))
+    _, merged = connected_components(graph, directed=False)
+    return merged[components]
+
+def radius_components(X, radius, chunk_size=2048, blocks=None, max_chunk_entries=MAX_CHUNK_ENTRIES):
+    """
+    Connected component of each row of X in the graph linking the rows whose cosine
+    distance is <= radius. X must hold L2-normalised rows (the TfidfVectorizer default).
+    With blocks (one key per row), only rows with the same key are compared.
+
+    Similarities are computed a few rows at a time. A chunk holds at most
+    max_chunk_entries similarities, even when a common term such as "report" makes them
+    dense. Links are folded into the component labels as they are found instead of
+    being kept as a graph.
+    """
+    X = csr_matrix(X)
+    n = X.shape[0]
+    # A small tolerance only ever adds links, which keeps the components a safe superset
+    min_similarity = 1 - radius - 1e-9
+    components = np.arange(n)
+    groups = [np.arange(n)] if blocks is None else block_members(blocks)
+    rows, cols, buffered = [], [], 0
+    for members in groups:
+        # A single row has no neighbours to find
+        if len(members) < 2:
+            continue
+        X_block = X if blocks is None else X[members]
+        X_block_T = X_block.T.tocsr()
+        step = max(1, min(chunk_size, max_chunk_entries // len(members)))
+        for start in range(0, len(members), step):
+            similarity = (X_block[start:start + step] @ X_block_T).tocoo()
+            keep = similarity.data >= min_similarity
+            chunk_rows = members[similarity.row[keep] + start]
+            chunk_cols = members[similarity.col[keep]]
+            # Links inside a known component add nothing
+            new = components[chunk_rows] != components[chunk_cols]
+            rows.append(chunk_rows[new])
+            cols.append(chunk_cols[new])
+            buffered += int(new.sum())
+            if buffered > max_chunk_entries:
+                components = merge_links(components, np.concatenate(rows), np.concatenate(cols))
+                rows, cols, buffered = [], [], 0
+    if buffered:
+        components = merge_links(components, np.concatenate(rows), np.concatenate(cols))
+    return components
+
+def weighted_average_labels(distances, sizes, distance_threshold):
+    """
+    Average-linkage clusters of weighted nodes: node i stands for sizes[i] rows and
+    distances holds the average row distance between nodes. Merges below the threshold
+    are kept. Uses the nearest-neighbour chain, so only the K x K matrix is needed.
+    """
+    k = len(sizes)
+    distances = np.array(distances, dtype=float)
+    np.fill_diagonal(distances, np.inf)
+    sizes = np.asarray(sizes, dtype=float).copy()
+    active = np.ones(k, dtype=bool)
+    merged = np.arange(k)
+    chain = []
+    for _ in range(k - 1):
+        if not chain:
+            chain.append(int(np.flatnonzero(active)[0]))
+        while True:
+            a = chain[-1]
+            b = int(np.argmin(distances[a]))
+            # Prefer the previous chain node on ties so the chain always ends
+            if len(chain) > 1 and distances[a, chain[-2]] <= distances[a, b]:
+                b = chain[-2]
+            if len(chain) > 1 and b == chain[-2]:
+                break
+            chain.append(b)
+        chain.pop()
+        chain.pop()
+        # Average linkage has no inversions, so the merges below the threshold give the cut
+        if distances[a, b] < distance_threshold:
+            merged[merged == merged[b]] = merged[a]
+        row = (sizes[a] * distances[a] + sizes[b] * distances[b]) / (sizes[a] + sizes[b])
+        distances[a], distances[:, a] = row, row
+        distances[b], distances[:, b] = np.inf, np.inf
+        distances[a, a] = np.inf
+        sizes[a] += sizes[b]
+        active[b] = False
+    return np.unique(merged, return_inverse=True)[1]
+
+def merge_piece_clusters(X, labels, distance_threshold, max_clusters):
+    """
+    Merge clusters found in separate pieces with average linkage over the clusters.
+    For L2-normalised rows the average cosine distance between clusters A and B is
+    1 - mean(A) . mean(B), so the clusters' mean vectors give it exactly.
+    """
+    k = labels.max() + 1
+    if k < 2 or k > max_clusters:
+        return labels
+    sizes = np.bincount(labels)
+    membership = csr_matrix((1 / sizes[labels], (labels, np.arange(len(labels)))), shape=(k, len(labels)))
+    means = membership @ X
+    distances = 1 - (means @ means.T).toarray()
+    return weighted_average_labels(distances, sizes, distance_threshold)[labels]
+
+def cluster_members(X, members, distance_threshold, linkage, max_block_size, radius, chunk_size, max_chunk_entries):
+    """
+    Cluster labels (from 0) of the rows of one component found at the given radius,
+    and whether they are exact.
+
+    Above max_block_size, duplicate rows are merged first since they always end up in
+    one group; with average linkage and few enough distinct rows the groups are still
+    exact. Otherwise the component is split at a tighter radius, each piece is
+    clustered on its own and, for average linkage, the piece clusters are merged again.
+    """
+    if len(members) == 1:
+        return np.zeros(1, dtype=int), True
+    if max_block_size is None or len(members) <= max_block_size:
+        distance_matrix = pairwise_distances(X[members], metric='cosine')
+        clustering = AgglomerativeClustering(n_clusters=None, distance_threshold=distance_threshold, metric='precomputed', linkage=linkage)
+        clustering.fit(distance_matrix)
+        return clustering.labels_, True
+    duplicates = np.unique(radius_components(X[members], 0, chunk_size, None, max_chunk_entries), return_inverse=True)[1]
+    if duplicates.max() == 0 or (linkage == 'average' and duplicates.max() < max_block_size):
+        return merge_piece_clusters(X[members], duplicates, distance_threshold, max_block_size), True
+
+    tighter = radius * SPLIT_RADIUS_FACTOR
+    if tighter < MIN_SPLIT_RADIUS:
+        tighter = 0
+    labels = np.empty(len(members), dtype=int)
+    next_label = 0
+    for piece in block_members(radius_components(X[members], tighter, chunk_size, None, max_chunk_entries)):
+        piece_labels, _ = cluster_members(X, members[piece], distance_threshold, linkage, max_block_size, tighter, chunk_size, max_chunk_entries)
+        labels[piece] = piece_labels + next_label
+        next_label += piece_labels.max() + 1
+    if linkage == 'average':
+        labels = merge_piece_clusters(X[members], labels, distance_threshold, max_block_size)
+    return labels, False
+
+def sparse_agglomerative_labels(X, distance_threshold, linkage='average', max_block_size=MAX_BLOCK_SIZE, chunk_size=2048, blocks=None,
+                                max_chunk_entries=MAX_CHUNK_ENTRIES, return_stats=False):
+    """
+    Cluster the rows of X like AgglomerativeClustering on the dense cosine distance
+    matrix, but one connected component of the sparse neighbour graph at a time.
+
+    A component larger than max_block_size is reduced to its distinct rows, which
+    average linkage can still cluster exactly from their weighted mean vectors. When
+    there are too many distinct rows, it is split again at a tighter radius, each piece
+    is clustered on its own and the piece clusters are merged again; those groups are
+    approximate and a warning gives the number of rows affected. Set max_block_size to
+    None to always cluster densely.
+    With blocks (one key per row), rows of different blocks are never grouped together.
+    Labels are numbered in order of first appearance. With return_stats, a dict with
+    the number of components above max_block_size, their rows, the rows with
+    approximate groups and the largest component is returned as well.
+    """
+    X = csr_matrix(X)
+    n = X.shape[0]
+    labels = np.full(n, -1, dtype=int)
+    stats = {'oversizedComponents': 0, 'oversizedRows': 0, 'approximateRows': 0, 'largestComponent': 0}
+    if n == 0:
+        return (labels, stats) if return_stats else labels
+
+    components = radius_components(X, distance_threshold, chunk_size, blocks, max_chunk_entries)
+    next_label = 0
+    for members in block_members(components):
+        stats['largestComponent'] = max(stats['largestComponent'], len(members))
+        if max_block_size is not None and len(members) > max_block_size:
+            stats['oversizedComponents'] += 1
+            stats['oversizedRows'] += len(members)
+        component_labels, exact = cluster_members(X, members, distance_threshold, linkage, max_block_size, distance_threshold, chunk_size, max_chunk_entries)
+        if not exact:
+            stats['approximateRows'] += len(members)
+        labels[members] = component_labels + next_label
+        next_label += component_labels.max() + 1
+
+    if stats['approximateRows']:
+        warnings.warn(f"{stats['approximateRows']} rows are in groups of similar names with more than {max_block_size} "
+                      f"distinct names; they were split and merged again, so their report groups are approximate",
+                      ApproximateClusteringWarning, stacklevel=2)
+
+    # Renumber in order of first appearance so the labels do not depend on component ids
+    _, first_seen, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    rank = np.empty(len(first_seen), dtype=int)
+    rank[np.argsort(first_seen)] = np.arange(len(first_seen))
+    return (rank[inverse], stats) if return_stats else rank[inverse]
+
+def run_clustering(cluster, *args, **kwargs):
+    """
+    Call cluster(*args, **kwargs) and collect the ApproximateClusteringWarning messages
+    it raises. Returns (result, messages), so an app can show the messages to the user.
+    """
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always', ApproximateClusteringWarning)
+        result = cluster(*args, **kwargs)
+    messages = [str(warning.message) for warning in caught if issubclass(warning.category, ApproximateClusteringWarning)]
+    return result, messages
@@ -0,0 +1,85 @@
+# Shared helper for the accelerators that collect rows from many uploaded reports.
+# Rows are appended column by column and the DataFrame is built once at the end,
+# instead of re-copying a growing DataFrame with pd.concat for every file.
+
+import pandas as pd
+
+class RowAccumulator:
+    """
+    Collect rows (dicts) or whole DataFrames into per-column lists.
+
+    With spill_path set, the buffered rows are appended to that CSV file every
+    chunk_size rows, so long runs only keep one chunk in memory. Columns are
+    fixed once the first chunk has been written.
+    """
+
+    def __init__(self, columns=None, spill_path=None, chunk_size=100000):
+        self.columns = list(columns) if columns else []
+        self.spill_path = spill_path
+        self.chunk_size = chunk_size
+        self.spilled_rows = 0
+        self._data = {column: [] for column in self.columns}
+        self._buffered = 0
+
+    def __len__(self):
+        return self.spilled_rows + self._buffered
+
+    def _add_column(self, column):
+        if self.spilled_rows:
+            raise ValueError(f"Column '{column}' appeared after rows were already written to {self.spill_path}")
+        self.columns.append(column)
+        self._data[column] = [None] * self._buffered
+
+    def append(self, row):
+        for column in row:
+            if column not in self._data:
+                self._add_column(column)
+        for column in self.columns:
+            self._data[column].append(row.get(column))
+        self._buffered += 1
+        if self.spill_path and self._buffered >= self.chunk_size:
+            self.flush()
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def extend_frame(self, df):
+        for column in df.columns:
+            if column not in self._data:
+                self._add_column(column)
+        for column in self.columns:
+            if column in df.columns:
+                self._data[column].extend(df[column].tolist())
+            else:
+                self._data[column].extend([None] * len(df))
+        self._buffered += len(df)
+        if self.spill_path and self._buffered >= self.chunk_size:
+            self.flush()
+
+    def _buffered_frame(self):
+        return pd.DataFrame(self._data, columns=self.columns)
+
+    def flush(self):
+        """
+        Append the buffered rows to spill_path and release them from memory.
+        """
+        if not self.spill_path or (not self._buffered and self.spilled_rows):
+            return
+        first_chunk = self.spilled_rows == 0
+        self._buffered_frame().to_csv(self.spill_path, mode='w' if first_chunk else 'a', header=first_chunk, index=False)
+        self.spilled_rows += self._buffered
+        self._data = {column: [] for column in self.columns}
+        self._buffered = 0
+
+    def to_frame(self):
+        """
+        Build the DataFrame once. In spill mode the rows are read back from spill_path.
+        """
+        if self.spill_path:
+            self.flush()
+            if not self.spilled_rows:
+                # Nothing was written, and an empty spill file cannot be read back
+                return pd.DataFrame(columns=self.columns)
+            return pd.read_csv(self.spill_path)
+        return self._buffered_frame()
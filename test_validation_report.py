@@ -0,0 +1,26 @@
+# Checks that the streamed large-file path gives the same report as the in-memory path.
+
+import pandas as pd
+
+from validation_report import generate_validation_report, validate_large_files
+
+def test_csv_and_excel_keep_na_dimension_values(tmp_path):
+    # 'NA' is North America and 'NULL' a real code, not missing values; 'na' folds with 'NA'
+    cognos_df = pd.DataFrame({'Region': ['NA', 'EU', 'NULL'], 'Product_ID': ['P1', 'P2', 'P3'], 'Sales': [1.0, 2.0, 3.0]})
+    pbi_df = pd.DataFrame({'Region': ['na', 'EU', 'NULL'], 'Product_ID': ['P1', 'P2', 'P3'], 'Sales': [1.0, 2.5, 3.0]})
+    expected, _, _, expected_summary = generate_validation_report(cognos_df.copy(), pbi_df.copy())
+
+    cognos_path = tmp_path / 'cognos.csv'
+    pbi_path = tmp_path / 'pbi.xlsx'
+    output = tmp_path / 'report.csv'
+    cognos_df.to_csv(cognos_path, index=False)
+    pbi_df.to_excel(pbi_path, sheet_name='PBI', index=False)
+    summary = validate_large_files(str(cognos_path), str(pbi_path), str(output), partitions=4)
+
+    report = pd.read_csv(output, keep_default_na=False).sort_values('unique_key', ignore_index=True)
+    expected = expected.sort_values('unique_key', ignore_index=True)
+    assert report['unique_key'].tolist() == expected['unique_key'].tolist() == ['EU-P2', 'NA-P1', 'NULL-P3']
+    assert report['Region'].tolist() == expected['Region'].tolist()
+    assert report['presence'].tolist() == expected['presence'].tolist()
+    assert report['Sales_Match'].astype(str).tolist() == expected['Sales_Match'].astype(str).tolist()
+    pd.testing.assert_frame_equal(summary.reset_index(drop=True), expected_summary.reset_index(drop=True), check_dtype=False)
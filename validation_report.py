@@ -2,56 +2,352 @@ import streamlit as st
 import pandas as pd
 import io
 import numpy as np
+import argparse
+import sys
+import os
+import tempfile
+import time
+from openpyxl import Workbook, load_workbook
 
-def generate_validation_report(cognos_df, pbi_df):
-    # Identify dimensions and measures
-    dims = [col for col in cognos_df.columns if col in pbi_df.columns and 
+# Labels of the merge indicator in the validation report
+PRESENCE_LABELS = {
+    'both': 'Present in Both',
+    'left_only': 'Present in Cognos',
+    'right_only': 'Present in PBI'
+}
+
+# Columns of the per-measure mismatch summary
+SUMMARY_COLUMNS = ['Measure', 'presence', 'Rows', 'Mismatches', 'Max Abs Diff', 'Sum of Diff']
+
+def folded_dimension(series):
+    """
+    Factorize a dimension column and case-fold its distinct values.
+    Returns (codes, text) so that text[codes] is the upper-cased string of every row,
+    while each distinct value is converted only once.
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    text = pd.Index(uniques).astype(str).str.upper().to_numpy(dtype=object)
+    return codes, text
+
+def hash_dimension_key(df, dims):
+    """
+    64-bit key of the case-folded dimension values, built without joining strings.
+    Each column is hashed separately, so values containing '-' cannot collide.
+    """
+    key = np.zeros(len(df), dtype=np.uint64)
+    for dim in dims:
+        codes, text = folded_dimension(df[dim])
+        hashed = pd.util.hash_array(text)
+        key = (key * np.uint64(1099511628211)) ^ hashed[codes]
+    return pd.Series(key, index=df.index)
+
+def display_dimension_key(df, dims):
+    """
+    Human-readable key: the upper-cased dimension values joined with '-'.
+    """
+    columns = []
+    for dim in dims:
+        codes, text = folded_dimension(df[dim])
+        columns.append(pd.Series(text[codes], index=df.index))
+    if not columns:
+        return pd.Series('', index=df.index)
+    return columns[0].str.cat(columns[1:], sep='-')
+
+def detect_dimensions(cognos_df, pbi_df):
+    """
+    Dimensions are the shared text columns plus any ID/Key columns; everything else is a measure.
+    """
+    return [col for col in cognos_df.columns if col in pbi_df.columns and 
             (cognos_df[col].dtype == 'object' or '_id' in col.lower() or '_key' in col.lower() or
              '_ID' in col or '_KEY' in col)]
+
+def generate_validation_report(cognos_df, pbi_df, key_mode='hash', display_key=True, dims=None,
+                               abs_tol=0.0, rel_tol=0.0, tolerances=None):
+    """
+    Compare the Cognos and PBI sheets row by row on their dimensions.
+    Returns the validation report, both sheets with their key and a per-measure summary.
+
+    key_mode='hash' joins on a 64-bit hash of the case-folded dimension values,
+    key_mode='string' on the legacy '-'-joined unique_key. With display_key the
+    readable unique_key column is still added to the sheets and the report.
+    dims overrides the detected dimension columns.
+
+    A measure matches when |PBI - Cognos| <= max(abs_tol, rel_tol * max(|PBI|, |Cognos|)),
+    missing values counting as 0. tolerances maps a measure to its own (abs_tol, rel_tol).
+    """
+    # Identify dimensions and measures
+    if dims is None:
+        dims = detect_dimensions(cognos_df, pbi_df)
     cognos_measures = [col for col in cognos_df.columns if col not in dims]
     pbi_measures = [col for col in pbi_df.columns if col not in dims]
     all_measures = list(set(cognos_measures) & set(pbi_measures))  # Only measures present in both
 
-    # Create a unique key by concatenating all dimensions
-    cognos_df['unique_key'] = cognos_df[dims].astype(str).agg('-'.join, axis=1).str.upper()  # Capitalize for case-insensitive comparison
-    pbi_df['unique_key'] = pbi_df[dims].astype(str).agg('-'.join, axis=1).str.upper()  # Capitalize for case-insensitive comparison
+    if key_mode == 'string':
+        # Create a unique key by concatenating all dimensions
+        cognos_df['unique_key'] = cognos_df[dims].astype(str).agg('-'.join, axis=1).str.upper()  # Capitalize for case-insensitive comparison
+        pbi_df['unique_key'] = pbi_df[dims].astype(str).agg('-'.join, axis=1).str.upper()  # Capitalize for case-insensitive comparison
+        key_columns = ['unique_key']
+        cognos_keys = cognos_df[key_columns]
+        pbi_keys = pbi_df[key_columns]
+    else:
+        key_columns = ['dimension_key']
+        cognos_keys = hash_dimension_key(cognos_df, dims).to_frame('dimension_key')
+        pbi_keys = hash_dimension_key(pbi_df, dims).to_frame('dimension_key')
+        if display_key:
+            cognos_df['unique_key'] = display_dimension_key(cognos_df, dims)
+            pbi_df['unique_key'] = display_dimension_key(pbi_df, dims)
 
     # Move 'unique_key' to the first column
-    cognos_df = cognos_df[['unique_key'] + [col for col in cognos_df.columns if col != 'unique_key']]
-    pbi_df = pbi_df[['unique_key'] + [col for col in pbi_df.columns if col != 'unique_key']]
+    if 'unique_key' in cognos_df.columns:
+        cognos_df = cognos_df[['unique_key'] + [col for col in cognos_df.columns if col != 'unique_key']]
+        pbi_df = pbi_df[['unique_key'] + [col for col in pbi_df.columns if col != 'unique_key']]
 
-    # Create the validation report dataframe
-    validation_report = pd.DataFrame({'unique_key': list(set(cognos_df['unique_key']) | set(pbi_df['unique_key']))})
+    # Join both sheets once on the key; for duplicated keys the last row wins, as before
+    carried = (['unique_key'] if key_mode != 'string' and display_key else []) + dims + all_measures
+    validation_report = pd.merge(
+        pd.concat([cognos_keys, cognos_df[carried]], axis=1).drop_duplicates(key_columns, keep='last'),
+        pd.concat([pbi_keys, pbi_df[carried]], axis=1).drop_duplicates(key_columns, keep='last'),
+        on=key_columns, how='outer', suffixes=('_Cognos', '_PBI'), indicator='presence'
+    )
+    if 'unique_key' in carried:
+        validation_report['unique_key'] = validation_report['unique_key_Cognos'].fillna(validation_report['unique_key_PBI'])
 
-    # Add dimensions
+    # Add dimensions, taken from Cognos and filled from PBI
     for dim in dims:
-        validation_report[dim] = validation_report['unique_key'].map(dict(zip(cognos_df['unique_key'], cognos_df[dim])))
-        validation_report[dim].fillna(validation_report['unique_key'].map(dict(zip(pbi_df['unique_key'], pbi_df[dim]))), inplace=True)
+        validation_report[dim] = validation_report[f'{dim}_Cognos'].fillna(validation_report[f'{dim}_PBI'])
 
     # Determine presence in sheets
-    validation_report['presence'] = validation_report['unique_key'].apply(
-        lambda key: 'Present in Both' if key in cognos_df['unique_key'].values and key in pbi_df['unique_key'].values
-        else ('Present in Cognos' if key in cognos_df['unique_key'].values
-              else 'Present in PBI')
-    )
+    validation_report['presence'] = validation_report['presence'].map(PRESENCE_LABELS).astype(object)
 
-    # Add measures and calculate differences
+    # Calculate measure differences (PBI - Cognos), match flags and the summary in one pass
+    tolerances = tolerances or {}
+    presence = validation_report['presence']
+    summaries = []
     for measure in all_measures:
-        validation_report[f'{measure}_Cognos'] = validation_report['unique_key'].map(dict(zip(cognos_df['unique_key'], cognos_df[measure])))
-        validation_report[f'{measure}_PBI'] = validation_report['unique_key'].map(dict(zip(pbi_df['unique_key'], pbi_df[measure])))
-        
-        # Calculate difference (PBI - Cognos)
+        cognos_values = validation_report[f'{measure}_Cognos'].fillna(0)
+        pbi_values = validation_report[f'{measure}_PBI'].fillna(0)
         #validation_report[f'{measure}_Diff'] = validation_report[f'{measure}_PBI'] - validation_report[f'{measure}_Cognos']
-        validation_report[f'{measure}_Diff'] = validation_report[f'{measure}_PBI'].fillna(0) - validation_report[f'{measure}_Cognos'].fillna(0)
+        diff = pbi_values - cognos_values
+        abs_diff = diff.abs()
+        measure_abs_tol, measure_rel_tol = tolerances.get(measure, (abs_tol, rel_tol))
+        allowed = np.maximum(measure_abs_tol, measure_rel_tol * np.maximum(cognos_values.abs(), pbi_values.abs()))
+        validation_report[f'{measure}_Diff'] = diff
+        validation_report[f'{measure}_Match'] = abs_diff <= allowed
+
+        measure_summary = pd.DataFrame({
+            'presence': presence, 'mismatch': ~validation_report[f'{measure}_Match'], 'abs_diff': abs_diff, 'diff': diff
+        }).groupby('presence').agg(
+            Rows=('diff', 'size'), Mismatches=('mismatch', 'sum'),
+            **{'Max Abs Diff': ('abs_diff', 'max'), 'Sum of Diff': ('diff', 'sum')}
+        ).reset_index()
+        measure_summary.insert(0, 'Measure', measure)
+        summaries.append(measure_summary)
+    summary = pd.concat(summaries, ignore_index=True) if summaries else pd.DataFrame(columns=SUMMARY_COLUMNS)
 
     # Reorder columns
-    column_order = ['unique_key'] + dims + ['presence'] + \
+    column_order = (['unique_key'] if 'unique_key' in validation_report.columns else []) + dims + ['presence'] + \
                    [col for measure in all_measures for col in 
-                    [f'{measure}_Cognos', f'{measure}_PBI', f'{measure}_Diff']]
+                    [f'{measure}_Cognos', f'{measure}_PBI', f'{measure}_Diff', f'{measure}_Match']]
     validation_report = validation_report[column_order]
 
-    return validation_report, cognos_df, pbi_df
+    return validation_report, cognos_df, pbi_df, summary
 
+def combine_summaries(summaries):
+    """
+    Merge the summaries of several report partitions into one.
+    """
+    summaries = [summary for summary in summaries if not summary.empty]
+    if not summaries:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+    return pd.concat(summaries, ignore_index=True).groupby(['Measure', 'presence'], sort=False).agg({
+        'Rows': 'sum', 'Mismatches': 'sum', 'Max Abs Diff': 'max', 'Sum of Diff': 'sum'
+    }).reset_index()
+
+def all_within_tolerance(summary):
+    """
+    True when every row is present in both sheets and every measure is within tolerance.
+    """
+    return (not summary.empty and summary['Mismatches'].sum() == 0
+            and (summary['presence'] == PRESENCE_LABELS['both']).all())
+
+
+def csv_text_cell(value):
+    # Raw CSV text of a dimension cell; only an empty cell is missing, as in Excel
+    return value if value != '' else None
+
+def read_sheet_chunks(source, sheet_name=None, chunksize=100000, text_columns=()):
+    """
+    Yield a CSV, Parquet or Excel sheet as DataFrame chunks without loading it at once.
+    Excel is streamed with openpyxl in read-only mode. text_columns are read as text,
+    so dimension values compare the same way in every chunk. In a CSV they skip pandas'
+    NA parsing, so values such as 'NA' (North America) or 'NULL' stay text as in Excel.
+    """
+    extension = os.path.splitext(str(getattr(source, 'name', source)))[1].lower()
+    if extension == '.csv':
+        yield from pd.read_csv(source, chunksize=chunksize, converters={col: csv_text_cell for col in text_columns})
+    elif extension in ('.parquet', '.pq'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        workbook = load_workbook(source, read_only=True, data_only=True)
+        try:
+            rows = workbook[sheet_name].iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            numeric_columns = [col for col in header if col not in text_columns]
+            buffer = []
+            for row in rows:
+                buffer.append(row)
+                if len(buffer) == chunksize:
+                    chunk = pd.DataFrame(buffer, columns=header, dtype=object)
+                    chunk[numeric_columns] = chunk[numeric_columns].infer_objects()
+                    yield chunk
+                    buffer = []
+            if buffer:
+                chunk = pd.DataFrame(buffer, columns=header, dtype=object)
+                chunk[numeric_columns] = chunk[numeric_columns].infer_objects()
+                yield chunk
+        finally:
+            workbook.close()
+
+def generate_validation_report_chunked(cognos_chunks, pbi_chunks, dims, partitions=16, display_key=True, **tolerance):
+    """
+    Compare two sheets that arrive in chunks. Rows are spilled to a temporary directory in
+    hash partitions of the dimension key, then each partition pair is compared on its own,
+    so memory is bounded by the largest partition. Yields (report, summary) one partition
+    at a time; tolerance takes the abs_tol/rel_tol/tolerances of generate_validation_report.
+    """
+    with tempfile.TemporaryDirectory(prefix='validation_report_') as spill_dir:
+        spilled = {}
+        columns = {}
+        for side, chunks in (('cognos', cognos_chunks), ('pbi', pbi_chunks)):
+            for number, chunk in enumerate(chunks):
+                columns.setdefault(side, chunk.columns)
+                partition = hash_dimension_key(chunk, dims).to_numpy() % np.uint64(partitions)
+                for part, rows in chunk.groupby(partition, sort=False):
+                    path = os.path.join(spill_dir, f'{side}-{part}-{number}.pkl')
+                    rows.to_pickle(path)
+                    spilled.setdefault((side, part), []).append(path)
+
+        for part in range(partitions):
+            sides = []
+            for side in ('cognos', 'pbi'):
+                paths = spilled.get((side, part), [])
+                if paths:
+                    sides.append(pd.concat([pd.read_pickle(path) for path in paths], ignore_index=True))
+                else:
+                    sides.append(pd.DataFrame(columns=columns.get(side, dims)))
+            if not len(sides[0]) and not len(sides[1]):
+                continue
+            validation_report, _, _, summary = generate_validation_report(
+                sides[0], sides[1], display_key=display_key, dims=dims, **tolerance)
+            yield validation_report, summary
+
+def write_report(frames, output, sheet_name='Validation_Report', summary=None):
+    """
+    Write report chunks to CSV or to a write-only (constant-memory) Excel workbook.
+    Excel sheets roll over to a new sheet when they reach the row limit.
+    summary is a callable returning the summary DataFrame once all frames are written;
+    it goes to a 'Summary' sheet, or next to a CSV output as <name>_summary.csv.
+    """
+    if output.lower().endswith('.csv'):
+        first = True
+        for frame in frames:
+            frame.to_csv(output, mode='w' if first else 'a', header=first, index=False)
+            first = False
+        if summary is not None:
+            summary().to_csv(os.path.splitext(output)[0] + '_summary.csv', index=False)
+        return
+
+    excel_row_limit = 1048576
+    workbook = Workbook(write_only=True)
+    sheet = None
+    sheet_rows = 0
+    for frame in frames:
+        values = frame.astype(object).where(frame.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            if sheet is None or sheet_rows == excel_row_limit:
+                sheet = workbook.create_sheet(sheet_name if sheet is None else f'{sheet_name}_{len(workbook.worksheets) + 1}')
+                sheet.append(list(frame.columns))
+                sheet_rows = 1
+            sheet.append(row)
+            sheet_rows += 1
+    if summary is not None:
+        summary_df = summary()
+        summary_sheet = workbook.create_sheet('Summary')
+        summary_sheet.append(list(summary_df.columns))
+        for row in summary_df.astype(object).itertuples(index=False, name=None):
+            summary_sheet.append(row)
+    elif sheet is None:
+        workbook.create_sheet(sheet_name)
+    workbook.save(output)
+
+def validate_large_files(cognos_source, pbi_source, output, cognos_sheet='Cognos', pbi_sheet='PBI',
+                         partitions=16, chunksize=100000, display_key=True, skip_clean=False, **tolerance):
+    """
+    Large-file path: stream both extracts, compare them partition by partition and stream the
+    validation report and its summary to output (.xlsx or .csv). The input sheets are not
+    copied back. With skip_clean the row-level report is left out when every row is within tolerance.
+    Returns the summary.
+    """
+    # Dimensions are detected on the first rows of both extracts
+    cognos_sample = next(read_sheet_chunks(cognos_source, cognos_sheet, chunksize=1000), pd.DataFrame())
+    pbi_sample = next(read_sheet_chunks(pbi_source, pbi_sheet, chunksize=1000), pd.DataFrame())
+    dims = detect_dimensions(cognos_sample, pbi_sample)
+
+    cognos_chunks = read_sheet_chunks(cognos_source, cognos_sheet, chunksize, text_columns=dims)
+    pbi_chunks = read_sheet_chunks(pbi_source, pbi_sheet, chunksize, text_columns=dims)
+    partition_results = generate_validation_report_chunked(cognos_chunks, pbi_chunks, dims, partitions, display_key, **tolerance)
+
+    summaries = []
+    def summary():
+        return combine_summaries(summaries)
+
+    if not skip_clean:
+        def reports():
+            for validation_report, partition_summary in partition_results:
+                summaries.append(partition_summary)
+                yield validation_report
+        write_report(reports(), output, summary=summary)
+        return summary()
+
+    # Keep the partition reports on disk until we know whether any row is out of tolerance
+    with tempfile.TemporaryDirectory(prefix='validation_report_') as report_dir:
+        paths = []
+        for number, (validation_report, partition_summary) in enumerate(partition_results):
+            summaries.append(partition_summary)
+            paths.append(os.path.join(report_dir, f'report-{number}.pkl'))
+            validation_report.to_pickle(paths[-1])
+        frames = () if all_within_tolerance(summary()) else (pd.read_pickle(path) for path in paths)
+        write_report(frames, output, summary=summary)
+    return summary()
+
+def benchmark(rows, dims=3, measures=3, seed=0):
+    """
+    Time generate_validation_report on two synthetic sheets of the given number of rows.
+    Roughly 90% of the keys are shared, the rest are only in one of the sheets.
+    """
+    rng = np.random.default_rng(seed)
+
+    def make_sheet(keys):
+        sheet = pd.DataFrame({f'Dim_{i}': pd.Series(keys % (1000 * (i + 1))).astype(str).radd(f'D{i}-').values
+                              for i in range(dims)})
+        sheet['Row_ID'] = keys.astype(str)
+        for i in range(measures):
+            sheet[f'Measure_{i}'] = rng.random(len(keys)) * 1000
+        return sheet
+
+    shared = int(rows * 0.9)
+    cognos_df = make_sheet(np.arange(rows))
+    pbi_df = make_sheet(np.concatenate([np.arange(shared), np.arange(rows, 2 * rows - shared)]))
+
+    start = time.perf_counter()
+    validation_report, _, _, _ = generate_validation_report(cognos_df, pbi_df)
+    elapsed = time.perf_counter() - start
+    print(f"{rows:,} rows per sheet -> {len(validation_report):,} report rows in {elapsed:.1f}s")
+    return elapsed
 
 def main():
     st.title("Validation Report Generator")
@@ -72,13 +368,23 @@ def main():
 
     uploaded_file = st.file_uploader("Upload Excel file", type="xlsx")
 
+    tolerance_columns = st.columns(2)
+    abs_tol = tolerance_columns[0].number_input("Absolute tolerance", min_value=0.0, value=0.0, format="%f")
+    rel_tol = tolerance_columns[1].number_input("Relative tolerance", min_value=0.0, value=0.0, format="%f",
+                                                help="Fraction of the larger of the two values, e.g. 0.001 for 0.1%")
+    skip_clean = st.checkbox("Leave out the row-level sheet when everything is within tolerance")
+
     if uploaded_file is not None:
         try:
             xls = pd.ExcelFile(uploaded_file)
             cognos_df = pd.read_excel(xls, 'Cognos')
             pbi_df = pd.read_excel(xls, 'PBI')
 
-            validation_report, cognos_df, pbi_df = generate_validation_report(cognos_df, pbi_df)
+            validation_report, cognos_df, pbi_df, summary = generate_validation_report(cognos_df, pbi_df, abs_tol=abs_tol, rel_tol=rel_tol)
+            write_rows = not (skip_clean and all_within_tolerance(summary))
+
+            st.subheader("Mismatch Summary")
+            st.dataframe(summary)
 
             st.subheader("Validation Report Preview")
             st.dataframe(validation_report)
@@ -88,7 +394,9 @@ def main():
             with pd.ExcelWriter(output, engine='openpyxl') as writer:
                 cognos_df.to_excel(writer, sheet_name='Cognos', index=False)
                 pbi_df.to_excel(writer, sheet_name='PBI', index=False)
-                validation_report.to_excel(writer, sheet_name='Validation_Report', index=False)
+                if write_rows:
+                    validation_report.to_excel(writer, sheet_name='Validation_Report', index=False)
+                summary.to_excel(writer, sheet_name='Summary', index=False)
 
             output.seek(0)
             
@@ -102,5 +410,48 @@ def main():
         except Exception as e:
             st.error(f"An error occurred: {str(e)}")
 
+def cli_main(argv=None):
+    parser = argparse.ArgumentParser(description="Validation report generator")
+    parser.add_argument('--benchmark', type=int, metavar='ROWS', help="Time the comparison on two synthetic sheets of ROWS rows")
+    parser.add_argument('--workbook', help="Excel workbook with the 'Cognos' and 'PBI' sheets")
+    parser.add_argument('--cognos', help="Cognos extract (.csv, .parquet or .xlsx)")
+    parser.add_argument('--pbi', help="PBI extract (.csv, .parquet or .xlsx)")
+    parser.add_argument('-o', '--output', default='validation_report.xlsx', help="Report file (.xlsx or .csv)")
+    parser.add_argument('--partitions', type=int, default=16, help="Number of hash partitions of the dimension key")
+    parser.add_argument('--chunksize', type=int, default=100000, help="Rows read at a time")
+    parser.add_argument('--no-display-key', action='store_true', help="Do not add the readable unique_key column")
+    parser.add_argument('--abs-tol', type=float, default=0.0, help="Absolute tolerance for every measure")
+    parser.add_argument('--rel-tol', type=float, default=0.0, help="Relative tolerance for every measure")
+    parser.add_argument('--tolerance', action='append', default=[], metavar='MEASURE=ABS[:REL]',
+                        help="Tolerance of a single measure; can be repeated")
+    parser.add_argument('--skip-clean', action='store_true', help="Only write the summary when every row is within tolerance")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        benchmark(args.benchmark)
+        return 0
+    cognos_source = args.cognos or args.workbook
+    pbi_source = args.pbi or args.workbook
+    if not cognos_source or not pbi_source:
+        parser.error("give --workbook or both --cognos and --pbi")
+
+    tolerances = {}
+    for item in args.tolerance:
+        measure, _, values = item.rpartition('=')
+        measure_abs_tol, _, measure_rel_tol = values.partition(':')
+        tolerances[measure] = (float(measure_abs_tol or 0), float(measure_rel_tol or 0))
+
+    summary = validate_large_files(cognos_source, pbi_source, args.output, partitions=args.partitions,
+                                   chunksize=args.chunksize, display_key=not args.no_display_key,
+                                   skip_clean=args.skip_clean, abs_tol=args.abs_tol, rel_tol=args.rel_tol,
+                                   tolerances=tolerances)
+    print(summary.to_string(index=False))
+    print(f"Validation report written to {args.output}")
+    return 0
+
 if __name__ == "__main__":
-    main()
+    # Command-line options run without the Streamlit UI
+    if len(sys.argv) > 1:
+        sys.exit(cli_main(sys.argv[1:]))
+    else:
+        main()